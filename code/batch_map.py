@@ -0,0 +1,73 @@
+# Map a recorded run in parallel: the frames are split into shards, each
+# worker process maps its shard into its own world map, and the partial maps
+# are summed. Counts only ever increase, so the merged map (clipped to the
+# WorldMap counter range) is the same map the sequential path produces.
+# Example: $ python batch_map.py ../test_dataset --workers 4 --output map.npy
+import argparse
+import time
+from multiprocessing import Pool, cpu_count
+import numpy as np
+
+from dataset import open_run
+from perception import map_frames, get_terrain_classifier
+from world_map import WorldMap, MapStatistics
+from rover_state import ground_truth_3d
+
+# Frames mapped together by perception.map_frames
+batch_size = 16
+
+# Define a function to map frames start:stop of a run into a fresh world map,
+# batch_size frames at a time. Partial maps use 32 bit counters so the shards
+# can be summed without saturating early.
+def map_shard(job):
+    path, start, stop, world_size = job
+    run = open_run(path)
+    world = WorldMap(world_size, dtype=np.uint32)
+    for chunk_start in range(start, stop, batch_size):
+        chunk_stop = min(chunk_start + batch_size, stop)
+        rows = run.telemetry[chunk_start:chunk_stop]
+        map_frames(run.frames(chunk_start, chunk_stop), rows['x'], rows['y'],
+                   rows['yaw'], rows['roll'], rows['pitch'], world)
+    return world.counts
+
+# Define a function to map a whole run with a pool of worker processes,
+# returning a WorldMap holding the merged counts
+def batch_map(path, workers=None, shard_size=64, world_size=200):
+    n_frames = len(open_run(path))
+    jobs = [(path, start, min(start + shard_size, n_frames), world_size)
+            for start in range(0, n_frames, shard_size)]
+    total = np.zeros((world_size, world_size, 3), dtype=np.uint64)
+    # Each worker builds its classifier lookup table once, when it starts
+    with Pool(workers or cpu_count(), initializer=get_terrain_classifier) as pool:
+        for counts in pool.imap_unordered(map_shard, jobs):
+            total += counts
+    world = WorldMap(world_size)
+    np.minimum(total, world.cap, out=total)
+    world.counts[:] = total
+    world.changed = None
+    world.version += 1
+    return world
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel mapping of a recorded run')
+    parser.add_argument(
+        'run',
+        type=str,
+        nargs='?',
+        default='../test_dataset',
+        help='Recorded run: a folder containing robot_log.csv (or the csv itself), or a packed run folder.'
+    )
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores).')
+    parser.add_argument('--shard-size', type=int, default=64, help='Frames per work item.')
+    parser.add_argument('--output', type=str, default=None, help='Save the merged map counts to this .npy file.')
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    world = batch_map(args.run, workers=args.workers, shard_size=args.shard_size)
+    elapsed = time.perf_counter() - t_start
+    stats = MapStatistics(ground_truth_3d)
+    stats.update(world)
+    print("Mapped {} in {:.2f} s  Mapped: {}%  Fidelity: {}%".format(
+          args.run, elapsed, stats.perc_mapped(), stats.fidelity()))
+    if args.output:
+        np.save(args.output, world.counts)
@@ -0,0 +1,179 @@
+# Microbenchmarks of the perception, decision and rendering functions on real
+# frames of a recorded run, with warmup, repeated rounds and JSON output.
+# Example: $ python benchmark.py ../test_dataset --output before.json
+#          $ python benchmark.py ../test_dataset --compare before.json
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import cv2
+
+from perception import (perspect_transform, color_thresh, obs_thresh, rock_thresh,
+                        rover_coords, pix_to_world, perception_step, calibration_points)
+from decision import decision_step
+from supporting_functions import update_rover, create_output_images
+from dataset import open_run, apply_telemetry, telemetry_message
+from replay import replay
+from instrumentation import StageTimer
+
+# Stages of the per-frame telemetry handler, whose medians add up to the
+# per-frame budget
+FRAME_STAGES = ['update_rover', 'perception_step', 'decision_step', 'create_output_images']
+
+# A benchmarked function. prepare(idx) runs untimed before every call and
+# returns the arguments for run, which is the timed part.
+class Benchmark():
+    def __init__(self, name, prepare, run):
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+
+# Define a function to build the benchmarks over the given frames of a run
+def make_benchmarks(run, frames):
+    images = [run.frame(idx) for idx in frames]
+    messages = [telemetry_message(run, idx) for idx in frames]
+    src, dst = calibration_points(images[0].shape)
+    warped = [perspect_transform(img, src, dst) for img in images]
+    navigable = [color_thresh(img) for img in warped]
+    coords = [rover_coords(binary) for binary in navigable]
+    # A Rover that has already seen the first frame, as in the simulator
+    Rover, timer = replay(run, start=frames[0], limit=1)
+
+    def load_frame(idx):
+        Rover.img = images[idx]
+        apply_telemetry(Rover, run.telemetry[frames[idx]])
+        return (Rover,)
+
+    def perceived(idx):
+        perception_step(*load_frame(idx))
+        return (Rover,)
+
+    def decided(idx):
+        decision_step(*perceived(idx))
+        return (Rover,)
+
+    def world_args(idx):
+        row = run.telemetry[frames[idx]]
+        return coords[idx] + (float(row['x']), float(row['y']), float(row['yaw']),
+                              Rover.worldmap.shape[0], 10)
+
+    return [
+        Benchmark('perspect_transform', lambda idx: (images[idx], src, dst), perspect_transform),
+        Benchmark('color_thresh', lambda idx: (warped[idx],), color_thresh),
+        Benchmark('obs_thresh', lambda idx: (warped[idx],), obs_thresh),
+        Benchmark('rock_thresh', lambda idx: (warped[idx],), rock_thresh),
+        Benchmark('rover_coords', lambda idx: (navigable[idx],), rover_coords),
+        Benchmark('pix_to_world', world_args, pix_to_world),
+        Benchmark('update_rover', lambda idx: (Rover, messages[idx]), update_rover),
+        Benchmark('perception_step', load_frame, perception_step),
+        Benchmark('decision_step', perceived, decision_step),
+        Benchmark('create_output_images', decided, create_output_images),
+    ]
+
+# Define a function to time every benchmark: warmup untimed calls, then
+# repeat rounds over all frames. Returns latency statistics in milliseconds.
+def run_benchmarks(benchmarks, n_frames, warmup=5, repeat=5, only=None):
+    results = {}
+    for benchmark in benchmarks:
+        if only and benchmark.name not in only:
+            continue
+        for idx in range(warmup):
+            benchmark.run(*benchmark.prepare(idx % n_frames))
+        timer = StageTimer(window=n_frames * repeat)
+        round_means = []
+        for round_idx in range(repeat):
+            total = 0
+            for idx in range(n_frames):
+                args = benchmark.prepare(idx)
+                t0 = time.perf_counter()
+                benchmark.run(*args)
+                elapsed = time.perf_counter() - t0
+                timer.record(benchmark.name, elapsed)
+                total += elapsed
+            round_means.append(total / n_frames * 1000)
+        result = timer.summary()[benchmark.name]
+        values = timer.samples[benchmark.name] * 1000
+        result['min'] = float(values.min())
+        result['stdev'] = float(values.std())
+        # Spread between rounds, a rough measure of how noisy the machine is
+        result['round_mean_min'] = min(round_means)
+        result['round_mean_max'] = max(round_means)
+        results[benchmark.name] = result
+    return results
+
+# Define a function to compare results with a baseline run, returning the
+# names of the benchmarks whose median is more than tolerance (a fraction)
+# slower than the baseline
+def compare(results, baseline, tolerance=0.1):
+    regressions = []
+    print('{:<22} {:>10} {:>10} {:>8}'.format('benchmark', 'base p50', 'p50', 'ratio'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['p50'] / baseline[name]['p50']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<22} {:>8.3f}ms {:>8.3f}ms {:>7.2f}x{}'.format(
+              name, baseline[name]['p50'], result['p50'], ratio, flag))
+    return regressions
+
+def print_results(results):
+    print('{:<22} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+          'benchmark', 'count', 'min', 'mean', 'p50', 'p95', 'p99'))
+    for name, result in results.items():
+        print('{:<22} {:>6} {:>7.3f}ms {:>7.3f}ms {:>7.3f}ms {:>7.3f}ms {:>7.3f}ms'.format(
+              name, result['count'], result['min'], result['mean'], result['p50'],
+              result['p95'], result['p99']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks on frames of a recorded run')
+    parser.add_argument(
+        'run',
+        type=str,
+        nargs='?',
+        default='../test_dataset',
+        help='Recorded run: a folder containing robot_log.csv (or the csv itself), or a packed run folder.'
+    )
+    parser.add_argument('--start', type=int, default=0, help='Index of the first frame to use.')
+    parser.add_argument('--frames', type=int, default=50, help='Number of frames to use.')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed calls before timing each benchmark.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed rounds over all frames.')
+    parser.add_argument('--only', type=str, nargs='+', default=None, help='Only run these benchmarks.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Compare with the JSON output of an earlier run; exits with status 1 on regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed slowdown of a median before it counts as a regression (fraction).')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Per-frame budget in ms for the telemetry handler stages; exits with status 1 if exceeded.')
+    args = parser.parse_args()
+
+    run = open_run(args.run)
+    frames = list(range(len(run))[args.start:args.start + args.frames])
+    results = run_benchmarks(make_benchmarks(run, frames), len(frames), args.warmup,
+                             args.repeat, args.only)
+    print_results(results)
+    failed = False
+    frame_total = sum(results[name]['p50'] for name in FRAME_STAGES if name in results)
+    print('Per-frame handler stages (sum of medians): {:.3f} ms'.format(frame_total))
+    if args.budget is not None and frame_total > args.budget:
+        print('Over the per-frame budget of {:.3f} ms'.format(args.budget))
+        failed = True
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'meta': {'run': args.run, 'frames': len(frames), 'warmup': args.warmup,
+                                'repeat': args.repeat, 'time': time.time(),
+                                'python': platform.python_version(), 'numpy': np.__version__,
+                                'opencv': cv2.__version__, 'machine': platform.machine()},
+                       'results': results}, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], args.tolerance)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,170 @@
+import os
+import re
+import csv
+import base64
+import numpy as np
+import cv2
+
+# Columns of the robot_log.csv written by the simulator in "Training Mode"
+ROBOT_LOG_COLUMNS = ['Path', 'SteerAngle', 'Throttle', 'Brake', 'Speed',
+                     'X_Position', 'Y_Position', 'Pitch', 'Yaw', 'Roll']
+
+# One row of telemetry from a recorded run
+TELEMETRY_DTYPE = np.dtype([('steer', np.float32), ('throttle', np.float32),
+                            ('brake', np.float32), ('speed', np.float32),
+                            ('x', np.float32), ('y', np.float32),
+                            ('pitch', np.float32), ('yaw', np.float32),
+                            ('roll', np.float32), ('time', np.float64)])
+
+# Simulator image names look like robocam_2017_05_02_11_16_21_421.jpg
+image_time_pattern = re.compile(r'(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(\d+)_(\d+)\.jpg$')
+
+# Define a function to read the time of day (seconds) a frame was recorded at
+# from its file name, or nan if the name does not carry a timestamp
+def image_time(path):
+    match = image_time_pattern.search(path)
+    if match is None:
+        return np.nan
+    hour, minute, second, msec = [int(group) for group in match.groups()[3:]]
+    return hour * 3600 + minute * 60 + second + msec / 1000
+
+# Define a function to find a frame of a run. The simulator writes absolute
+# or ../ relative paths, but the images always sit in IMG/ next to the log.
+def resolve_image_path(path, log_dir):
+    if os.path.isabs(path) and os.path.exists(path):
+        return path
+    candidate = os.path.normpath(os.path.join(log_dir, path))
+    if os.path.exists(candidate):
+        return candidate
+    return os.path.join(log_dir, 'IMG', os.path.basename(path.replace('\\', '/')))
+
+# Define a function to read a robot_log.csv into image paths and a structured
+# telemetry table (values may use either decimal convention)
+def read_robot_log(csv_path):
+    log_dir = os.path.dirname(os.path.abspath(csv_path))
+    with open(csv_path, newline='') as log_file:
+        reader = csv.reader(log_file, delimiter=';')
+        header = next(reader)
+        rows = [row for row in reader if row]
+    columns = dict((name, idx) for idx, name in enumerate(header))
+    telemetry = np.zeros(len(rows), dtype=TELEMETRY_DTYPE)
+    fields = ['steer', 'throttle', 'brake', 'speed', 'x', 'y', 'pitch', 'yaw', 'roll']
+    for field, column in zip(fields, ROBOT_LOG_COLUMNS[1:]):
+        telemetry[field] = [float(row[columns[column]].replace(',', '.')) for row in rows]
+    image_paths = [resolve_image_path(row[columns['Path']], log_dir) for row in rows]
+    telemetry['time'] = [image_time(path) for path in image_paths]
+    return image_paths, telemetry
+
+# Define a function to read an RGB frame from disk
+def load_frame(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise IOError('Could not read frame {}'.format(path))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+# A run recorded by the simulator: a robot_log.csv plus its IMG/ folder.
+# path can be the csv file itself or the folder containing it.
+class RecordedRun():
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, 'robot_log.csv')
+        self.path = path
+        self.image_paths, self.telemetry = read_robot_log(path)
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    def frame(self, idx):
+        return load_frame(self.image_paths[idx])
+
+    # Frames start:stop stacked into an (N, rows, cols, 3) array
+    def frames(self, start=0, stop=None):
+        return np.stack([self.frame(idx) for idx in range(len(self))[start:stop]])
+
+# A run in the packed format written by pack_run(): frames.npy holds every
+# frame as one (N, rows, cols, 3) uint8 array and telemetry.npy the
+# TELEMETRY_DTYPE table. Both are memory-mapped, so any frame range can be
+# sliced without reading (or decoding) the rest of the run.
+class PackedRun():
+    def __init__(self, folder):
+        self.path = folder
+        self.frames_array = np.load(os.path.join(folder, 'frames.npy'), mmap_mode='r')
+        self.telemetry = np.load(os.path.join(folder, 'telemetry.npy'), mmap_mode='r')
+        if len(self.frames_array) != len(self.telemetry):
+            raise ValueError('{} has {} frames but {} telemetry rows'.format(
+                             folder, len(self.frames_array), len(self.telemetry)))
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    def frame(self, idx):
+        return self.frames_array[idx]
+
+    def frames(self, start=0, stop=None):
+        return self.frames_array[start:stop]
+
+# Define a function to convert a run (e.g. a RecordedRun) to the packed
+# format, decoding chunk frames at a time
+def pack_run(run, folder, chunk=256):
+    os.makedirs(folder, exist_ok=True)
+    n_frames = len(run)
+    first = run.frame(0)
+    frames = np.lib.format.open_memmap(os.path.join(folder, 'frames.npy'), mode='w+',
+                                       dtype=np.uint8, shape=(n_frames,) + first.shape)
+    for start in range(0, n_frames, chunk):
+        stop = min(start + chunk, n_frames)
+        for idx in range(start, stop):
+            frames[idx] = run.frame(idx)
+        frames.flush()
+    del frames
+    np.save(os.path.join(folder, 'telemetry.npy'), np.asarray(run.telemetry, dtype=TELEMETRY_DTYPE))
+    return PackedRun(folder)
+
+# Define a function to open a run in either format: a packed run folder,
+# a folder with robot_log.csv, or the csv itself
+def open_run(path):
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, 'frames.npy')):
+        return PackedRun(path)
+    return RecordedRun(path)
+
+# Define a function to copy one telemetry row onto a RoverState
+def apply_telemetry(Rover, row):
+    Rover.vel = float(row['speed'])
+    Rover.pos = [float(row['x']), float(row['y'])]
+    Rover.yaw = float(row['yaw'])
+    Rover.pitch = float(row['pitch'])
+    Rover.roll = float(row['roll'])
+    Rover.throttle = float(row['throttle'])
+    Rover.steer = float(row['steer'])
+    return Rover
+
+# Define a function to read the JPEG bytes of a frame of a run, as the
+# simulator would send them (packed runs are re-encoded)
+def frame_jpeg(run, idx):
+    if isinstance(run, RecordedRun):
+        with open(run.image_paths[idx], 'rb') as image_file:
+            return image_file.read()
+    ok, jpeg = cv2.imencode('.jpg', cv2.cvtColor(run.frame(idx), cv2.COLOR_RGB2BGR))
+    return jpeg.tobytes()
+
+# Define a function to build the "telemetry" message the simulator would send
+# for a frame of a run. Recorded runs carry no sample positions, so none are
+# sent unless samples=(samples_x, samples_y) is given.
+def telemetry_message(run, idx, samples=None, sample_count=6, jpeg_bytes=None):
+    row = run.telemetry[idx]
+    if jpeg_bytes is None:
+        jpeg_bytes = frame_jpeg(run, idx)
+    samples_x, samples_y = samples if samples is not None else ([], [])
+    return {'speed': str(float(row['speed'])),
+            'position': '{};{}'.format(float(row['x']), float(row['y'])),
+            'yaw': str(float(row['yaw'])),
+            'pitch': str(float(row['pitch'])),
+            'roll': str(float(row['roll'])),
+            'throttle': str(float(row['throttle'])),
+            'steering_angle': str(float(row['steer'])),
+            'near_sample': '0',
+            'picking_up': '0',
+            'sample_count': str(sample_count),
+            'samples_x': ';'.join(str(value) for value in samples_x),
+            'samples_y': ';'.join(str(value) for value in samples_y),
+            'image': base64.b64encode(jpeg_bytes).decode('ascii')}
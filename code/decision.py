@@ -1,5 +1,4 @@
 import numpy as np
-from perception import rock_thresh
 
 # This is where you can build a decision tree for determining throttle, brake and steer
 # commands based on the output of the perception_step() function
@@ -15,17 +14,16 @@ def decision_step(Rover):
     within_stop_dist = Rover.mean_dist <= Rover.stop_forward
     # navigable terrain conditional var
     navigable_terr = len(Rover.nav_dists) > 0
+    # Perception features for this frame
+    features = Rover.features
+    # Obstacle pixel counts of the named regions (see perception.REGIONS)
     # conditional var, if obstacle is in front of Rover bumper
-    front_bumper = Rover.vision_image[141:148, 157:162, 0]
-    obstacle_in_way = np.count_nonzero(front_bumper) >= 8
+    obstacle_in_way = features.region_count('front_bumper') >= 8
     # conditional vars, if obstacles are in wheel path of Rover
-    front_left = Rover.vision_image[138:149, 150:155, 0]
-    obstacle_left = np.count_nonzero(front_left) > 0
+    obstacle_left = features.region_count('front_left') > 0
     # conditional var, if obstacle is up ahead and to the right
-    extended_front_far = Rover.vision_image[118:139, 163:170, 0]
-    extended_front_near = Rover.vision_image[140:147, 159:170, 0]
-    front_clear = (np.count_nonzero(extended_front_far) == 0 and
-                    np.count_nonzero(extended_front_near) == 0)
+    front_clear = (features.region_count('extended_front_far') == 0 and
+                    features.region_count('extended_front_near') == 0)
     # conditional var, if Rover has a good angle to come out of stop mode
     good_angle = -0.1 < Rover.local_mean_ang < 0.1
 
@@ -40,20 +38,14 @@ def decision_step(Rover):
     # Use warped top-down map to detect rock
     rock_nearby = False
     rock_aligned = False
-    rock_map = Rover.vision_image[:,:,1]
-    if np.count_nonzero(rock_map) > 0:
-        row_dists = np.nonzero(rock_map)[0] - 159
-        col_dists = np.nonzero(rock_map)[1] - 159.5
-        dists = np.sqrt(row_dists**2 + col_dists**2)
-        avg_x = np.mean(row_dists[dists <= 28])
-        avg_y = np.mean(col_dists[dists <= 28])
-        if avg_x < 0 and avg_y >= -5:
-            rock_nearby = True
+    avg_x = features.rock_near_x
+    avg_y = features.rock_near_y
+    if avg_x < 0 and avg_y >= -5:
+        rock_nearby = True
     if Rover.picking_up != 0:
         rock_nearby = False
     # Use camera image to align Rover to rock after rock detection
-    rock_cam = rock_thresh(Rover.img)
-    rock_center = np.mean(np.nonzero(rock_cam)[1])
+    rock_center = features.rock_center
     if rock_center >= 158 and rock_center <= 161:
         rock_aligned = True
 
@@ -80,8 +72,15 @@ def decision_step(Rover):
                 Rover.throttle = Rover.throttle_set
             else: # Else coast
                 Rover.throttle = 0
-            # Set steering to average angle clipped to the range +/- 15
-            if front_clear:
+            # Steer towards the unexplored frontier unless there is an
+            # obstacle in the wheel path, otherwise follow the wall on the
+            # right, or steer to average angle clipped to the range +/- 15
+            explore_steer = None
+            if Rover.planner is not None and not obstacle_left:
+                explore_steer = Rover.planner.steer(Rover)
+            if explore_steer is not None:
+                Rover.steer = explore_steer
+            elif front_clear:
                 Rover.steer = -8
             elif obstacle_left:
                 mean_ang_right = np.mean(Rover.nav_angles[Rover.nav_angles <= 0])
@@ -1,89 +1,34 @@
 # Do the necessary imports
 import argparse
 import shutil
-import base64
-from datetime import datetime
 import os
-import cv2
-import numpy as np
 import socketio
 import eventlet
 import eventlet.wsgi
-from PIL import Image
+from eventlet import tpool
+import functools
 from flask import Flask
-from io import BytesIO, StringIO
 import json
-import pickle
-import matplotlib.image as mpimg
 import time
 
 # Import functions for perception and decision making
-from perception import perception_step
-from decision import decision_step
-from supporting_functions import update_rover, create_output_images
+from perception import configure_terrain_classifier, get_terrain_classifier
+from instrumentation import StageTimer, NullTimer
+from rover_log import logger, setup_logging
+from frame_worker import FrameWorker
+from rover_session import RoverSession, SessionPool, NULL_ACTION
 # Initialize socketio server and Flask application
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 sio = socketio.Server()
 app = Flask(__name__)
 
-# Read in ground truth map and create 3-channel green version for overplotting
-# NOTE: images are read in by default with the origin (0, 0) in the upper left
-# and y-axis increasing downward.
-ground_truth = mpimg.imread('../calibration_images/map_bw.png')
-# This next line creates arrays of zeros in the red and blue channels
-# and puts the map into the green channel.  This is why the underlying
-# map output looks green in the display image
-ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.float)
-
-# Define RoverState() class to retain rover state parameters
-class RoverState():
-    def __init__(self):
-        self.start_time = None # To record the start time of navigation
-        self.total_time = None # To record total duration of naviagation
-        self.img = None # Current camera image
-        self.pos = None # Current position (x, y)
-        self.start_pos = None # Starting position (x, y)
-        self.yaw = None # Current yaw angle
-        self.pitch = None # Current pitch angle
-        self.roll = None # Current roll angle
-        self.vel = None # Current velocity
-        self.steer = 0 # Current steering angle
-        self.throttle = 0 # Current throttle value
-        self.brake = 0 # Current brake value
-        self.nav_angles = None # Angles of navigable terrain pixels
-        self.nav_dists = None # Distances of navigable terrain pixels
-        self.mean_dist = None
-        self.mean_ang = None
-        self.local_mean_ang = None
-        self.ground_truth = ground_truth_3d # Ground truth worldmap
-        self.mode = 'forward' # Current mode (can be forward or stop)
-        self.throttle_set = 0.2 # Throttle setting when accelerating
-        self.brake_set = 10 # Brake setting when braking
-        # The stop_forward and go_forward fields below represent total count
-        # of navigable terrain pixels.  This is a very crude form of knowing
-        # when you can keep going and when you should stop.  Feel free to
-        # get creative in adding new fields or modifying these!
-        self.stop_forward = 15 # Threshold to initiate stopping
-        self.go_forward = 20 # Threshold to go forward again
-        self.max_vel = 1.2 # Maximum velocity (meters/second)
-        # Image output from perception step
-        # Update this image to display your intermediate analysis steps
-        # on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=np.float)
-        # Worldmap
-        # Update this image with the positions of navigable terrain
-        # obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=np.float)
-        self.head_home = False
-        self.samples_pos = None # To store the actual sample positions
-        self.samples_to_find = 0 # To store the initial count of samples
-        self.samples_located = 0 # To store number of samples located on map
-        self.samples_collected = 0 # To count the number of samples collected
-        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
-        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
-        self.send_pickup = False # Set to True to trigger rock pickup
-# Initialize our rover
-Rover = RoverState()
+# Rover sessions by socket.io sid, as (RoverSession, FrameWorker) pairs. The
+# session is None when it lives in a worker process (--processes) and the
+# worker is None when telemetry is processed inline.
+sessions = {}
+sessions_started = 0
+# RoverSession options, filled in from the command line
+session_options = {}
 
 # Variables to track frames per second (FPS)
 # Intitialize frame counter
@@ -92,6 +37,50 @@ frame_counter = 0
 second_counter = time.time()
 fps = None
 
+# Per-stage latency timer, replaced by a StageTimer when profiling is enabled
+timer = NullTimer()
+# Process telemetry off the event loop, one FrameWorker per session (--pipelined)
+pipelined = False
+# Worker processes running the sessions (--processes)
+pool = None
+
+# Define a function to look up the session of a connection, starting one on
+# its first message
+def get_session(sid):
+    global sessions_started
+    entry = sessions.get(sid)
+    if entry is None:
+        send = functools.partial(send_action, sid)
+        if pool is not None:
+            session = None
+            worker = FrameWorker(functools.partial(pool.process, sid), send,
+                                 fallback=NULL_ACTION)
+        else:
+            session = RoverSession(sessions_started, session_options, timer)
+            worker = (FrameWorker(session.process, send, fallback=NULL_ACTION)
+                      if pipelined else None)
+        sessions_started += 1
+        entry = sessions[sid] = (session, worker)
+        logger.info("Started rover session %s for %s", sessions_started - 1, sid,
+                    extra={'rate_key': sid})
+    return entry
+
+# Define a function to end the session of a connection
+def close_session(sid):
+    session, worker = sessions.pop(sid, (None, None))
+    if worker is not None:
+        logger.info("Frame worker %s closed: %s", sid, worker.close(), extra={'rate_key': sid})
+    # Closing joins the session's background threads (flushing any queued
+    # recording), so it runs on a native thread to keep the event loop serving
+    # the other connections
+    if session is not None:
+        recording = tpool.execute(session.close)
+    elif pool is not None:
+        recording = tpool.execute(pool.close_session, sid)
+    else:
+        return
+    if recording is not None:
+        logger.info("Recording of %s finished: %s", sid, recording, extra={'rate_key': sid})
 
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
@@ -99,71 +88,57 @@ def telemetry(sid, data):
 
     global frame_counter, second_counter, fps
     frame_counter+=1
-    # Do a rough calculation of frames per second (FPS)
+    # Do a rough calculation of frames per second (FPS), over all sessions
     if (time.time() - second_counter) > 1:
         fps = frame_counter
         frame_counter = 0
         second_counter = time.time()
-    print("Current FPS: {}".format(fps))
+        logger.info("Current FPS: %s (%s sessions)", fps, len(sessions))
+        for worker_sid, (session, worker) in list(sessions.items()):
+            if worker is not None:
+                logger.info("Frame worker %s: %s", worker_sid, worker.stats(),
+                            extra={'rate_key': worker_sid})
 
     if data:
-        global Rover
-        # Initialize / update Rover with current telemetry
-        Rover, image = update_rover(Rover, data)
-
-        if np.isfinite(Rover.vel):
-
-            # Execute the perception and decision steps to update the Rover's state
-            Rover = perception_step(Rover)
-            Rover = decision_step(Rover)
-
-            # Create output images to send to server
-            out_image_string1, out_image_string2 = create_output_images(Rover)
-
-            # The action step!  Send commands to the rover!
-
-            # Don't send both of these, they both trigger the simulator
-            # to send back new telemetry so we must only send one
-            # back in respose to the current telemetry data.
-
-            # If in a state where want to pickup a rock send pickup command
-            if Rover.send_pickup and not Rover.picking_up:
-                send_pickup()
-                # Reset Rover flags
-                Rover.send_pickup = False
-            else:
-                # Send commands to the rover!
-                commands = (Rover.throttle, Rover.brake, Rover.steer)
-                send_control(commands, out_image_string1, out_image_string2)
-
-        # In case of invalid telemetry, send null commands
+        session, worker = get_session(sid)
+        if worker is not None:
+            # Processed and answered by the session's frame worker
+            worker.submit(data)
         else:
+            send_action(sid, session.process(data), data)
 
-            # Send zeros for throttle, brake and steer and empty images
-            send_control((0, 0, 0), '', '')
-
-        # If you want to save camera images from autonomous driving specify a path
-        # Example: $ python drive_rover.py image_folder_path
-        # Conditional to save image frame if folder was specified
-        if args.image_folder != '':
-            timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
-            image_filename = os.path.join(args.image_folder, timestamp)
-            image.save('{}.jpg'.format(image_filename))
+    else:
+        sio.emit('manual', data={}, room=sid)
 
+# The action step!  Send commands to the rover! Replies only go to the
+# connection the telemetry came from. A frame_id sent with the telemetry
+# (e.g. by sim_client.py) is echoed back with the reply.
+def send_action(sid, action, data=None):
+    frame_id = data.get('frame_id') if data else None
+    if action[0] == 'pickup':
+        with timer.stage('send_pickup'):
+            send_pickup(frame_id, sid)
     else:
-        sio.emit('manual', data={}, skip_sid=True)
+        with timer.stage('send_control'):
+            send_control(*action[1:], frame_id=frame_id, sid=sid)
 
 @sio.on('connect')
 def connect(sid, environ):
-    print("connect ", sid)
-    send_control((0, 0, 0), '', '')
+    logger.info("connect %s", sid, extra={'rate_key': sid})
+    send_control((0, 0, 0), '', '', sid=sid)
     sample_data = {}
     sio.emit(
         "get_samples",
         sample_data,
-        skip_sid=True)
+        room=sid)
+
+@sio.on('disconnect')
+def disconnect(sid):
+    logger.info("disconnect %s", sid, extra={'rate_key': sid})
+    close_session(sid)
 
-def send_control(commands, image_string1, image_string2):
+# Send commands to the connection sid (every connection if sid is None)
+def send_control(commands, image_string1, image_string2, frame_id=None, sid=None):
     # Define commands to be sent to the rover
     data={
         'throttle': commands[0].__str__(),
@@ -172,20 +147,24 @@ def send_control(commands, image_string1, image_string2):
         'inset_image1': image_string1,
         'inset_image2': image_string2,
         }
+    if frame_id is not None:
+        data['frame_id'] = frame_id
     # Send commands via socketIO server
     sio.emit(
         "data",
         data,
-        skip_sid=True)
+        room=sid)
     eventlet.sleep(0)
 # Define a function to send the "pickup" command
-def send_pickup():
-    print("Picking up")
+def send_pickup(frame_id=None, sid=None):
+    logger.info("Picking up")
     pickup = {}
+    if frame_id is not None:
+        pickup['frame_id'] = frame_id
     sio.emit(
         "pickup",
         pickup,
-        skip_sid=True)
+        room=sid)
     eventlet.sleep(0)
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Remote Driving')
@@ -196,8 +175,124 @@ if __name__ == '__main__':
         default='',
         help='Path to image folder. This is where the images from the run will be saved.'
     )
+    parser.add_argument(
+        '--record-queue',
+        type=int,
+        default=128,
+        help='Frames that may wait to be written to disk before frames are dropped.'
+    )
+    parser.add_argument(
+        '--record-writers',
+        type=int,
+        default=2,
+        help='Number of threads writing recorded frames to disk.'
+    )
+    parser.add_argument(
+        '--log-level',
+        type=str,
+        default='WARNING',
+        help='Rover log level (DEBUG, INFO, WARNING, ...). DEBUG logs the full rover status every frame.'
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Shorthand for --log-level DEBUG.'
+    )
+    parser.add_argument(
+        '--log-rate',
+        type=float,
+        default=1.0,
+        help='Maximum records per second for each log message, 0 for no limit.'
+    )
+    parser.add_argument(
+        '--log-file',
+        type=str,
+        default=None,
+        help='Write the rover log to this file instead of stderr.'
+    )
+    parser.add_argument(
+        '--inset-every',
+        type=int,
+        default=1,
+        help='Refresh the simulator inset images every N frames, 0 to disable them.'
+    )
+    parser.add_argument(
+        '--inset-hz',
+        type=float,
+        default=None,
+        help='Refresh the simulator inset images at most this many times per second.'
+    )
+    parser.add_argument(
+        '--sync-insets',
+        action='store_true',
+        help='Encode the inset images on the telemetry handler instead of a background thread.'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage of the telemetry handler and print a report on exit.'
+    )
+    parser.add_argument(
+        '--profile-file',
+        type=str,
+        default=None,
+        help='Periodically write per-stage latency percentiles to this JSON file (implies --profile).'
+    )
+    parser.add_argument(
+        '--profile-port',
+        type=int,
+        default=None,
+        help='Serve per-stage latency percentiles as JSON on this localhost port (implies --profile).'
+    )
+    parser.add_argument(
+        '--profile-interval',
+        type=float,
+        default=5.0,
+        help='Seconds between writes of --profile-file.'
+    )
+    parser.add_argument(
+        '--thresholds',
+        type=str,
+        default=None,
+        help='JSON file with terrain thresholds, e.g. the best setting written by tune_thresholds.py.'
+    )
+    parser.add_argument(
+        '--explore',
+        action='store_true',
+        help='Steer towards unexplored frontiers of the world map instead of following the wall.'
+    )
+    parser.add_argument(
+        '--pipelined',
+        action='store_true',
+        help='Process telemetry on a worker thread, dropping frames that arrive while it is busy.'
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=0,
+        help='Run the rover sessions in this many worker processes (implies --pipelined, stage profiling covers only the main process).'
+    )
     args = parser.parse_args()
 
+    thresholds = None
+    if args.thresholds:
+        with open(args.thresholds) as thresholds_file:
+            thresholds = json.load(thresholds_file)['best']
+        configure_terrain_classifier(**thresholds)
+    else:
+        # Build the lookup table now rather than in the first frame
+        get_terrain_classifier()
+
+    log_options = {'level': 'DEBUG' if args.verbose else args.log_level.upper(),
+                   'max_rate': args.log_rate, 'log_file': args.log_file}
+    setup_logging(**log_options)
+    if args.profile or args.profile_file or args.profile_port:
+        timer = StageTimer(export_path=args.profile_file,
+                           export_interval=args.profile_interval)
+        if args.profile_port:
+            timer.serve(args.profile_port)
+            print("Serving stage latencies at http://127.0.0.1:{}/".format(args.profile_port))
+
     #os.system('rm -rf IMG_stream/*')
     if args.image_folder != '':
         print("Creating image folder at {}".format(args.image_folder))
@@ -210,8 +305,25 @@ if __name__ == '__main__':
     else:
         print("NOT recording this run ...")
 
+    session_options = {'inset_every': args.inset_every, 'inset_hz': args.inset_hz,
+                       'sync_insets': args.sync_insets, 'record_folder': args.image_folder,
+                       'record_queue': args.record_queue, 'record_writers': args.record_writers,
+                       'explore': args.explore}
+    pipelined = args.pipelined
+    if args.processes > 0:
+        pool = SessionPool(args.processes, session_options, thresholds, log_options)
+        print("Running rover sessions in {} worker processes".format(args.processes))
+
     # wrap Flask application with socketio's middleware
     app = socketio.Middleware(sio, app)
 
     # deploy as an eventlet WSGI server
-    eventlet.wsgi.server(eventlet.listen(('', 4567)), app)
+    try:
+        eventlet.wsgi.server(eventlet.listen(('', 4567)), app)
+    finally:
+        for sid in list(sessions):
+            close_session(sid)
+        if pool is not None:
+            pool.close()
+        if isinstance(timer, StageTimer):
+            print(timer.format_report())
@@ -0,0 +1,81 @@
+import time
+import eventlet
+import eventlet.queue
+from eventlet import tpool
+
+from rover_log import logger
+
+# Processes telemetry off the socket.io event loop. The handler only drops
+# each message into a one-frame, latest-frame-wins slot; a green thread takes
+# the newest message, runs process(data) on a native thread (eventlet.tpool)
+# so the hub keeps receiving, then calls send(result, data) back on the hub,
+# where socket.io emits are safe. A message that is replaced in the slot before the
+# worker gets to it is dropped, so under load commands lag by at most one
+# frame instead of queueing up behind a growing backlog. If process(data)
+# raises, fallback (when not None) is sent in place of its result so the
+# client still gets an answer.
+class FrameWorker():
+    def __init__(self, process, send, use_tpool=True, fallback=None):
+        self.process = process
+        self.send = send
+        self.use_tpool = use_tpool
+        self.fallback = fallback
+        self.received = 0 # Messages submitted
+        self.processed = 0 # Messages processed
+        self.dropped = 0 # Messages replaced by a newer one before processing
+        self.stale = 0 # Results sent after a newer message had already arrived
+        self.last_latency = 0 # Seconds from submit to send of the latest result
+        self._slot = eventlet.queue.LightQueue(maxsize=1)
+        self._running = True
+        self._thread = eventlet.spawn(self._work)
+
+    # Hand a message to the worker, replacing any message still waiting
+    def submit(self, data):
+        self.received += 1
+        if self._slot.full():
+            try:
+                self._slot.get_nowait()
+                self.dropped += 1
+            except eventlet.queue.Empty:
+                pass
+        self._slot.put_nowait((time.perf_counter(), data))
+
+    def _work(self):
+        while self._running:
+            t_submit, data = self._slot.get()
+            if data is None:
+                return
+            try:
+                if self.use_tpool:
+                    result = tpool.execute(self.process, data)
+                else:
+                    result = self.process(data)
+                self.processed += 1
+            except Exception:
+                logger.exception("Failed to process telemetry")
+                result = self.fallback
+                if result is None:
+                    continue
+            if not self._slot.empty():
+                self.stale += 1
+            try:
+                self.send(result, data)
+                self.last_latency = time.perf_counter() - t_submit
+            except Exception:
+                logger.exception("Failed to send result")
+
+    # Summary of the worker counters
+    def stats(self):
+        return {'received': self.received, 'processed': self.processed,
+                'dropped': self.dropped, 'stale': self.stale,
+                'last_latency_ms': round(self.last_latency * 1000, 3)}
+
+    def close(self):
+        if self._thread is not None:
+            self._running = False
+            if self._slot.full():
+                self._slot.get_nowait()
+            self._slot.put_nowait((time.perf_counter(), None))
+            self._thread.wait()
+            self._thread = None
+        return self.stats()
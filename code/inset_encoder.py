@@ -0,0 +1,82 @@
+import threading
+import time
+
+from supporting_functions import OutputSnapshot, MapInsetCache, render_output_images
+from rover_log import logger
+
+# Produces the two inset image strings sent with every control command.
+# The insets are purely cosmetic, so they are refreshed according to a
+# policy and drawn/encoded on a background thread; send_control just reuses
+# the most recent strings and never waits on JPEG encoding.
+#   every_n_frames: refresh on every Nth frame, 0 disables the insets
+#   max_hz:         additionally refresh at most this many times per second
+#   background:     encode on a worker thread (False encodes inline)
+class InsetEncoder():
+    def __init__(self, every_n_frames=1, max_hz=None, background=True):
+        self.every_n_frames = every_n_frames
+        self.min_interval = 1.0 / max_hz if max_hz else 0
+        self.background = background
+        self.strings = ('', '') # Latest encoded (map inset, vision inset)
+        self.frame = 0
+        self.last_refresh = None
+        self.encoded = 0 # Snapshots encoded
+        self.superseded = 0 # Snapshots replaced by a newer one before encoding
+        self.cache = MapInsetCache()
+        self._pending = None
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        if background and every_n_frames > 0:
+            self._running = True
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+
+    def due(self):
+        if self.every_n_frames <= 0 or self.frame % self.every_n_frames != 0:
+            return False
+        if self.last_refresh is None:
+            return True
+        return time.monotonic() - self.last_refresh >= self.min_interval
+
+    # Call once per frame after decision_step. Schedules a refresh if one is
+    # due and returns the latest available inset strings.
+    def update(self, Rover):
+        if self.due():
+            self.last_refresh = time.monotonic()
+            if self.background:
+                snapshot = OutputSnapshot(Rover, copy=True)
+                with self._condition:
+                    if self._pending is not None:
+                        self.superseded += 1
+                    self._pending = snapshot
+                    self._condition.notify()
+            else:
+                self._encode(OutputSnapshot(Rover, copy=True))
+        self.frame += 1
+        return self.strings
+
+    def _encode(self, snapshot):
+        self.strings = render_output_images(snapshot, self.cache)
+        self.encoded += 1
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                snapshot = self._pending
+                self._pending = None
+            try:
+                self._encode(snapshot)
+            except Exception:
+                logger.exception("Failed to encode inset images")
+
+    def close(self):
+        if self._thread is not None:
+            with self._condition:
+                self._running = False
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
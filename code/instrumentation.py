@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# A named stage timed with "with timer.stage(name):". A new object is made for
+# every timed block, so blocks of the same stage running at the same time
+# (on different green or native threads) each keep their own start time.
+class _Stage():
+    __slots__ = ('timer', 'name', 't_start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.t_start = 0
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.record(self.name, time.perf_counter() - self.t_start)
+        return False
+
+# Per-stage latency instrumentation. The most recent `window` samples of each
+# stage are kept in a ring buffer and summarized as mean/p50/p95/p99.
+# Samples may be recorded from several threads (the event loop and tpool
+# workers), so the buffers are only touched under a lock.
+# Summaries can be written to a JSON file every export_interval seconds
+# (see frame_done) and/or served as JSON over HTTP on localhost.
+class StageTimer():
+    def __init__(self, window=1000, export_path=None, export_interval=5.0):
+        self.window = window
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.samples = {} # Stage name -> ring buffer of latencies (seconds)
+        self.counts = {} # Stage name -> total samples recorded
+        self.order = [] # Stage names in the order they were first seen
+        self._lock = threading.Lock()
+        self.last_export = time.monotonic()
+        self.server = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            buffer = self.samples.get(name)
+            if buffer is None:
+                buffer = self.samples[name] = np.zeros(self.window)
+                self.counts[name] = 0
+                self.order.append(name)
+            buffer[self.counts[name] % self.window] = seconds
+            self.counts[name] += 1
+
+    # Latency statistics in milliseconds, per stage
+    def summary(self):
+        with self._lock:
+            snapshot = [(name, self.counts[name],
+                         self.samples[name][:min(self.counts[name], self.window)] * 1000)
+                        for name in self.order]
+        result = {}
+        for name, count, values in snapshot:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {'count': count, 'mean': float(values.mean()),
+                            'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+        return result
+
+    # Call once per frame; exports the summary when it is due
+    def frame_done(self):
+        if self.export_path is None:
+            return
+        now = time.monotonic()
+        if now - self.last_export >= self.export_interval:
+            self.last_export = now
+            self.export(self.export_path)
+
+    def export(self, path):
+        # Write to a temporary file first so readers never see partial JSON
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as export_file:
+            json.dump(self.summary(), export_file, indent=2)
+        os.replace(temp_path, path)
+
+    # Serve the summary as JSON at http://127.0.0.1:<port>/ from a daemon thread
+    def serve(self, port):
+        timer = self
+        class SummaryHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(timer.summary(), indent=2).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        self.server = HTTPServer(('127.0.0.1', port), SummaryHandler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.server
+
+    def format_report(self):
+        lines = ['{:<16}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+                 'stage (ms)', 'count', 'mean', 'p50', 'p95', 'p99')]
+        for name, stats in self.summary().items():
+            lines.append('{:<16}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+                         name, stats['count'], stats['mean'], stats['p50'],
+                         stats['p95'], stats['p99']))
+        return '\n'.join(lines)
+
+# Stand-in for StageTimer when instrumentation is off
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class NullTimer():
+    def __init__(self):
+        self._stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, seconds):
+        pass
+
+    def frame_done(self):
+        pass
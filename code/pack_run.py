@@ -0,0 +1,19 @@
+# Convert a recorded run (robot_log.csv plus IMG/ frames) to the packed,
+# memory-mappable format read by dataset.PackedRun.
+# Example: $ python pack_run.py ../test_dataset ../test_dataset_packed
+import argparse
+import time
+
+from dataset import RecordedRun, pack_run
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a recorded run')
+    parser.add_argument('run', type=str, help='Folder containing robot_log.csv, or the csv itself.')
+    parser.add_argument('output', type=str, help='Folder to write frames.npy and telemetry.npy to.')
+    parser.add_argument('--chunk', type=int, default=256, help='Frames decoded per chunk.')
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    packed = pack_run(RecordedRun(args.run), args.output, chunk=args.chunk)
+    print("Packed {} frames into {} in {:.1f} s".format(
+          len(packed), args.output, time.perf_counter() - t_start))
@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+from world_map import OBSTACLE, ROCK, NAVIGABLE
 
 # Identify pixels above the threshold
 # Threshold of RGB > 160 does a nice job of identifying ground pixels only
@@ -52,6 +53,94 @@ def rock_thresh(img):
     thresh[mask] = 1
     return thresh
 
+# Pixel labels produced by the fused terrain classifier. Labels are bit flags
+# so a rock pixel can also count as an obstacle, exactly as the separate
+# threshold functions above report it. A label of 0 means unseen (black).
+LABEL_NAV = 1
+LABEL_OBSTACLE = 2
+LABEL_ROCK = 4
+
+# Single pass replacement for color_thresh, obs_thresh and rock_thresh.
+# Every possible RGB color is classified once into a 256x256x256 lookup table,
+# after which each frame costs one table lookup per pixel. The table is built
+# one red level (a 256x256 slice of colors) at a time, so building it needs
+# little memory beyond the 16 MB table itself.
+class TerrainClassifier():
+    def __init__(self, rgb_thresh=(160, 160, 160),
+                 rock_lower=(22, 150, 150), rock_upper=(28, 255, 255)):
+        levels = np.arange(256)
+        rock_lower = np.array(rock_lower)
+        rock_upper = np.array(rock_upper)
+        # Navigable terrain in a slice: green and blue above their thresholds
+        # (red is checked per slice)
+        green_blue = ((levels > rgb_thresh[1])[:, None]
+                      & (levels > rgb_thresh[2])[None, :])
+        # Colors of one slice, the red channel is filled in per slice
+        colors = np.empty((256, 256, 3), dtype=np.uint8)
+        colors[..., 1] = levels[:, None]
+        colors[..., 2] = levels[None, :]
+        self.lut = np.empty(256 * 256 * 256, dtype=np.uint8)
+        for red in range(256):
+            lut_slice = self.lut[red * 65536:(red + 1) * 65536].reshape(256, 256)
+            # Obstacle: not navigable, and not the black area outside the view
+            if red > rgb_thresh[0]:
+                lut_slice[:] = np.where(green_blue, LABEL_NAV, LABEL_OBSTACLE)
+            else:
+                lut_slice[:] = LABEL_OBSTACLE
+            if red == 0:
+                lut_slice[0, 0] = 0
+            # Rock: run every color through the same HSV conversion as rock_thresh
+            colors[..., 0] = red
+            hsv = cv2.cvtColor(colors, cv2.COLOR_RGB2HSV)
+            lut_slice[cv2.inRange(hsv, rock_lower, rock_upper) > 0] |= LABEL_ROCK
+        self._index = None
+
+    # Label every pixel of an RGB image, or of an (N, rows, cols, 3) stack
+    # of images, writing into out if given
+    def classify(self, img, out=None):
+        if out is None:
+            out = np.empty(img.shape[:-1], dtype=np.uint8)
+        if self._index is None or self._index.shape != img.shape[:-1]:
+            self._index = np.empty(img.shape[:-1], dtype=np.int32)
+        # Pack the three channels into a single 24 bit table index
+        index = self._index
+        np.copyto(index, img[..., 0])
+        index <<= 8
+        index |= img[..., 1]
+        index <<= 8
+        index |= img[..., 2]
+        np.take(self.lut, index, out=out, mode='clip')
+        return out
+
+# Split a label image into 0/1 binary images, one per class, written into the
+# caller's buffers (same result as color_thresh, obs_thresh and rock_thresh)
+def split_labels(labels, nav_out, obs_out, rock_out):
+    np.bitwise_and(labels, LABEL_NAV, out=nav_out)
+    np.bitwise_and(labels, LABEL_OBSTACLE, out=obs_out)
+    obs_out >>= 1
+    np.bitwise_and(labels, LABEL_ROCK, out=rock_out)
+    rock_out >>= 2
+    return nav_out, obs_out, rock_out
+
+# The lookup table takes a moment to build, so it is only built on first use.
+# Servers should call get_terrain_classifier() (or configure_terrain_classifier)
+# at startup so the first frame does not pay for it.
+terrain_classifier = None
+
+def get_terrain_classifier():
+    global terrain_classifier
+    if terrain_classifier is None:
+        terrain_classifier = TerrainClassifier()
+    return terrain_classifier
+
+# Define a function to replace the classifier used by perception_step with
+# one built from other thresholds (e.g. ones found by tune_thresholds.py)
+def configure_terrain_classifier(rgb_thresh=(160, 160, 160),
+                                 rock_lower=(22, 150, 150), rock_upper=(28, 255, 255)):
+    global terrain_classifier
+    terrain_classifier = TerrainClassifier(rgb_thresh, rock_lower, rock_upper)
+    return terrain_classifier
+
 # Define a function to convert from image coords to rover coords
 def rover_coords(binary_img):
     # Identify nonzero pixels
@@ -73,6 +162,67 @@ def to_polar_coords(x_pixel, y_pixel):
     angles = np.arctan2(y_pixel, x_pixel)
     return dist, angles
 
+# The warped image grid never changes size, so every pixel's rover-centric
+# coordinates, distance and angle are constants. PixelTables computes them
+# once; perception then selects the entries of a frame with a binary mask.
+class PixelTables():
+    def __init__(self, img_shape, local_dist=50):
+        rows, cols = img_shape[:2]
+        ypos, xpos = np.mgrid[0:rows, 0:cols]
+        # Same convention as rover_coords()
+        self.x = -(ypos - rows).astype(np.float32)
+        self.y = -(xpos - cols/2).astype(np.float32)
+        self.dist = np.sqrt(self.x**2 + self.y**2)
+        self.angle = np.arctan2(self.y, self.x)
+        # x and y stacked as a (2, rows*cols) matrix for batched transforms
+        self.xy = np.stack((self.x.ravel(), self.y.ravel()))
+        # Pixels close enough to the rover to steer by (Rover.local_mean_ang)
+        self.local = self.dist < local_dist
+        self.img_shape = (rows, cols)
+        self._local_mask = np.zeros((rows, cols), dtype=bool)
+        # Columns: distance, angle, local mask and angle of local pixels, so a
+        # stack of masks can be reduced with one matrix multiply
+        self.reductions = np.stack((self.dist.ravel(), self.angle.ravel(),
+                                    self.local.ravel(), (self.angle * self.local).ravel()),
+                                   axis=1).astype(np.float32)
+
+    # Rover-centric x, y of the nonzero pixels of a 0/1 binary image
+    def coords(self, binary_img):
+        mask = binary_img.view(bool)
+        return self.x[mask], self.y[mask]
+
+    # Polar coordinates (dist, angle) of the nonzero pixels of a binary image
+    def polar(self, binary_img):
+        mask = binary_img.view(bool)
+        return self.dist[mask], self.angle[mask]
+
+    # Mean angle of the nonzero pixels within local_dist of the rover
+    def local_mean_angle(self, binary_img):
+        local_mask = np.logical_and(binary_img.view(bool), self.local, out=self._local_mask)
+        return np.mean(self.angle[local_mask])
+
+    # Pixel count, mean distance, mean angle and local mean angle of the
+    # nonzero pixels of each image in an (N, rows, cols) stack of 0/1 binary
+    # images. Frames without pixels get nan means.
+    def polar_stats(self, binary_stack):
+        n_frames = binary_stack.shape[0]
+        masks = binary_stack.reshape(n_frames, -1)
+        counts = np.count_nonzero(masks, axis=1)
+        sums = np.dot(masks.astype(np.float32), self.reductions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_dist = sums[:, 0] / counts
+            mean_ang = sums[:, 1] / counts
+            local_mean_ang = sums[:, 3] / sums[:, 2]
+        return counts, mean_dist, mean_ang, local_mean_ang
+
+pixel_tables = None
+
+def get_pixel_tables(img_shape):
+    global pixel_tables
+    if pixel_tables is None or pixel_tables.img_shape != tuple(img_shape[:2]):
+        pixel_tables = PixelTables(img_shape)
+    return pixel_tables
+
 # Define a function to map rover space pixels to world space
 def rotate_pix(xpix, ypix, yaw):
     # Convert yaw to radians
@@ -104,6 +254,61 @@ def pix_to_world(xpix, ypix, xpos, ypos, yaw, world_size, scale):
     # Return the result
     return x_pix_world, y_pix_world
 
+# Batched version of pix_to_world for a whole label image: the pixels of
+# every class are projected together with a single 2x3 affine transform
+# (rotation, scale and translation) in float32, then split per label flag.
+# The per-frame path is the N=1 case of labels_to_world_batch, so both give
+# bit-identical results.
+# Returns a list of (x_pix_world, y_pix_world) tuples, one per flag.
+def labels_to_world(labels, tables, xpos, ypos, yaw, world_size, scale,
+                    flags=(LABEL_OBSTACLE, LABEL_ROCK, LABEL_NAV)):
+    result = labels_to_world_batch(labels[None], tables, [xpos], [ypos], [yaw],
+                                   world_size, scale, flags)
+    return [(x_pix_world, y_pix_world) for frame, x_pix_world, y_pix_world in result]
+
+# Same as labels_to_world for an (N, rows, cols) stack of label images with
+# one pose per frame (xpos, ypos and yaw are length N sequences). Returns a
+# list of (frame, x_pix_world, y_pix_world) tuples, one per flag, where frame
+# is the index in the stack each pixel came from.
+def labels_to_world_batch(labels, tables, xpos, ypos, yaw, world_size, scale,
+                          flags=(LABEL_OBSTACLE, LABEL_ROCK, LABEL_NAV)):
+    n_frames = labels.shape[0]
+    flat_labels = labels.reshape(n_frames, -1)
+    # All labelled pixels, in any class
+    frame, pixel = np.nonzero(flat_labels)
+    seen_labels = flat_labels[frame, pixel]
+    # Rotation and scale of each frame's affine transform
+    yaw_rad = np.asarray(yaw, dtype=np.float64) * np.pi / 180
+    cos_yaw = (np.cos(yaw_rad) / scale).astype(np.float32)
+    sin_yaw = (np.sin(yaw_rad) / scale).astype(np.float32)
+    translation = np.array([xpos, ypos], dtype=np.float32)
+    xy = tables.xy[:, pixel]
+    if n_frames == 1:
+        # One transform for every pixel
+        cos_pix = cos_yaw[0]
+        sin_pix = sin_yaw[0]
+        translation = translation[:, :1]
+    else:
+        # Broadcast each pixel's frame transform
+        cos_pix = cos_yaw[frame]
+        sin_pix = sin_yaw[frame]
+        translation = translation[:, frame]
+    # Rotate and scale, then translate in place
+    world = np.empty_like(xy)
+    np.multiply(xy[0], cos_pix, out=world[0])
+    world[0] -= sin_pix * xy[1]
+    np.multiply(xy[0], sin_pix, out=world[1])
+    world[1] += cos_pix * xy[1]
+    world += translation
+    world_pix = world.astype(np.intp)
+    np.clip(world_pix, 0, world_size - 1, out=world_pix)
+    # Split back into the requested classes
+    result = []
+    for flag in flags:
+        in_class = (seen_labels & flag) != 0
+        result.append((frame[in_class], world_pix[0][in_class], world_pix[1][in_class]))
+    return result
+
 # Define a function to perform a perspective transform
 def perspect_transform(img, src, dst):
 
@@ -112,58 +317,258 @@ def perspect_transform(img, src, dst):
 
     return warped
 
+# Define source and destination points for the rover camera's perspective
+# transform. The camera geometry never changes, so these are calibrated once.
+def calibration_points(img_shape, dst_size=5, bottom_offset=9):
+    source = np.float32([[15, 140], [301 ,140],[200, 96], [119, 96]])
+    destination = np.float32([[img_shape[1]/2 - dst_size, img_shape[0] - bottom_offset - 1],
+                  [img_shape[1]/2 + dst_size - 1, img_shape[0] - bottom_offset - 1],
+                  [img_shape[1]/2 + dst_size - 1, img_shape[0] - 2*dst_size - bottom_offset],
+                  [img_shape[1]/2 - dst_size, img_shape[0] - 2*dst_size - bottom_offset],
+                  ])
+    return source, destination
+
+# Calibrated perspective warp. The homography, the cv2.remap lookup maps and
+# the output buffer are built once and reused for every frame.
+class WarpEngine():
+    def __init__(self, img_shape, src, dst, mask_row=152):
+        self.img_shape = tuple(img_shape)
+        rows, cols = self.img_shape[:2]
+        self.M = cv2.getPerspectiveTransform(src, dst)
+        # For every output pixel find the source pixel it samples from
+        # (this is what cv2.warpPerspective does internally on every call)
+        Minv = np.linalg.inv(self.M)
+        ypos, xpos = np.mgrid[0:rows, 0:cols].astype(np.float64)
+        denom = Minv[2, 0] * xpos + Minv[2, 1] * ypos + Minv[2, 2]
+        map_x = (Minv[0, 0] * xpos + Minv[0, 1] * ypos + Minv[0, 2]) / denom
+        map_y = (Minv[1, 0] * xpos + Minv[1, 1] * ypos + Minv[1, 2]) / denom
+        # Rows at and below mask_row see the rover itself; point them far
+        # outside the source image so the constant border fills them with 0
+        map_x[mask_row:, :] = -cols
+        map_y[mask_row:, :] = -rows
+        # Fixed-point maps are the fastest representation for cv2.remap
+        self.map1, self.map2 = cv2.convertMaps(map_x.astype(np.float32),
+                                               map_y.astype(np.float32),
+                                               cv2.CV_16SC2)
+        # Output buffer, overwritten by every call to warp()
+        self.warped = np.zeros(self.img_shape, dtype=np.uint8)
+
+    def warp(self, img):
+        # Note: the returned array is reused, copy it if it must outlive the frame
+        cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR,
+                  dst=self.warped, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return self.warped
+
+    # Warp an (N, rows, cols, 3) stack of images into out (allocated if None)
+    def warp_batch(self, imgs, out=None):
+        if out is None:
+            out = np.empty((len(imgs),) + self.img_shape, dtype=np.uint8)
+        for idx in range(len(imgs)):
+            cv2.remap(imgs[idx], self.map1, self.map2, cv2.INTER_LINEAR,
+                      dst=out[idx], borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return out
+
+# Engine for the current camera image size, built on the first frame
+warp_engine = None
+
+def get_warp_engine(img_shape):
+    global warp_engine
+    if warp_engine is None or warp_engine.img_shape != tuple(img_shape):
+        source, destination = calibration_points(img_shape)
+        warp_engine = WarpEngine(img_shape, source, destination)
+    return warp_engine
+
+
+# Named rectangular regions of the warped top-down view that decision rules
+# query, as half-open (row_start, row_stop), (col_start, col_stop) ranges.
+# The rover sits at the bottom center of the view, around (159, 159.5).
+REGIONS = {
+    'front_bumper': ((141, 148), (157, 162)), # Directly in front of the rover
+    'front_left': ((138, 149), (150, 155)), # Left wheel path
+    'extended_front_far': ((118, 139), (163, 170)), # Up ahead and to the right
+    'extended_front_near': ((140, 147), (159, 170)), # Just ahead and to the right
+}
+
+# Define a function to add (or replace) a named region
+def register_region(name, rows, cols):
+    REGIONS[name] = (tuple(rows), tuple(cols))
+
+# Per-frame features published by perception_step for decision_step, so the
+# decision step never has to look at an image itself. The buffers are
+# allocated once and refreshed in place on every frame.
+# Every frame gets a summed-area table (integral image) per label of the
+# warped view, so the pixel count of any rectangle costs four lookups.
+class PerceptionFeatures():
+    def __init__(self, img_shape, rock_near_dist=28):
+        rows, cols = img_shape[:2]
+        self.labels_cam = np.zeros((rows, cols), dtype=np.uint8) # Labels of the camera image
+        self.rock_cam = np.zeros((rows, cols), dtype=np.uint8) # Rock mask, camera view
+        self.rock_warped = None # Rock mask, warped top-down view
+        self.obstacle_warped = None # Obstacle mask, warped top-down view
+        # Summed-area tables of the warped navigable, obstacle and rock masks:
+        # integrals[label][r, c] is the pixel count of rows :r, cols :c
+        self._integrals = np.zeros((3, rows + 1, cols + 1), dtype=np.int32)
+        self.integrals = {LABEL_NAV: self._integrals[0],
+                          LABEL_OBSTACLE: self._integrals[1],
+                          LABEL_ROCK: self._integrals[2]}
+        self.rock_cam_count = 0 # Rock pixels in the camera view
+        self.rock_warped_count = 0 # Rock pixels in the warped view
+        self.nav_count = 0 # Navigable pixels in the warped view
+        self.obstacle_count = 0 # Obstacle pixels in the warped view
+        self.rock_center = np.nan # Mean column of rock pixels in the camera view
+        # Mean offset (rows, cols) of warped rock pixels within rock_near_dist
+        # pixels of the rover, relative to the rover at (159, 159.5)
+        self.rock_near_x = np.nan
+        self.rock_near_y = np.nan
+        self._col_index = np.arange(cols)
+        # Disk of pixels within rock_near_dist of the rover, cropped to its
+        # bounding box, with each pixel's offset from the rover
+        row_dists, col_dists = np.mgrid[0:rows, 0:cols] - np.array([159, 159.5])[:, None, None]
+        disk = np.sqrt(row_dists**2 + col_dists**2) <= rock_near_dist
+        disk_rows, disk_cols = np.nonzero(disk)
+        self._near_box = (slice(disk_rows.min(), disk_rows.max() + 1),
+                          slice(disk_cols.min(), disk_cols.max() + 1))
+        self._near_disk = disk[self._near_box]
+        self._near_row_dists = row_dists[self._near_box]
+        self._near_col_dists = col_dists[self._near_box]
+
+    def update(self, camera_img, nav_binary, obs_binary, rock_binary):
+        self.rock_warped = rock_binary
+        self.obstacle_warped = obs_binary
+        for label, binary in ((LABEL_NAV, nav_binary), (LABEL_OBSTACLE, obs_binary),
+                              (LABEL_ROCK, rock_binary)):
+            cv2.integral(binary, sum=self.integrals[label], sdepth=cv2.CV_32S)
+        self.nav_count = int(self.integrals[LABEL_NAV][-1, -1])
+        self.obstacle_count = int(self.integrals[LABEL_OBSTACLE][-1, -1])
+        self.rock_warped_count = int(self.integrals[LABEL_ROCK][-1, -1])
+        # Rock mask of the raw camera image, used to align with a sample
+        labels = get_terrain_classifier().classify(camera_img, out=self.labels_cam)
+        np.bitwise_and(labels, LABEL_ROCK, out=self.rock_cam)
+        self.rock_cam >>= 2
+        self.rock_cam_count = np.count_nonzero(self.rock_cam)
+        if self.rock_cam_count > 0:
+            col_counts = self.rock_cam.sum(axis=0)
+            self.rock_center = np.dot(col_counts, self._col_index) / self.rock_cam_count
+        else:
+            self.rock_center = np.nan
+        # Position of nearby rock in the warped view, used to detect a sample
+        self.rock_near_x = np.nan
+        self.rock_near_y = np.nan
+        if self.rock_warped_count > 0:
+            near = rock_binary[self._near_box].view(bool) & self._near_disk
+            if near.any():
+                self.rock_near_x = np.mean(self._near_row_dists[near])
+                self.rock_near_y = np.mean(self._near_col_dists[near])
+
+    # Count pixels with the given label inside rows[0]:rows[1], cols[0]:cols[1]
+    def count(self, label, rows, cols):
+        table = self.integrals[label]
+        return int(table[rows[1], cols[1]] - table[rows[0], cols[1]]
+                   - table[rows[1], cols[0]] + table[rows[0], cols[0]])
+
+    # Count pixels with the given label inside a region registered in REGIONS
+    def region_count(self, name, label=LABEL_OBSTACLE):
+        rows, cols = REGIONS[name]
+        return self.count(label, rows, cols)
+
+    # Count obstacle pixels inside rows[0]:rows[1], cols[0]:cols[1]
+    def count_obstacles(self, rows, cols):
+        return self.count(LABEL_OBSTACLE, rows, cols)
+
+# Define a function to check that the rover is level enough for the warped
+# view to be trusted when updating the world map (works on arrays too)
+def level_for_mapping(roll, pitch):
+    return (((np.asarray(roll) < 0.4) | (np.asarray(roll) > 359.6))
+            & ((np.asarray(pitch) < 0.4) | (np.asarray(pitch) > 359.6)))
+
+# Results of perception_batch for an (N, rows, cols, 3) stack of frames
+class BatchPerception():
+    def __init__(self, labels, polar_stats, world):
+        self.labels = labels # (N, rows, cols) label images
+        # Per frame navigable pixel count, mean distance, mean angle and
+        # local mean angle (nan where a frame has no navigable pixels)
+        self.nav_count, self.mean_dist, self.mean_ang, self.local_mean_ang = polar_stats
+        # (frame, x_pix_world, y_pix_world) for obstacle, rock and navigable
+        self.obstacle_world, self.rock_world, self.nav_world = world
+
+# Define a function to run perception on a whole stack of frames at once:
+# warp, classify, polar statistics and world projection, using per-frame
+# poses (xpos, ypos and yaw are length N sequences)
+def perception_batch(frames, xpos, ypos, yaw, world_size=200, scale=10):
+    warped = get_warp_engine(frames.shape[1:]).warp_batch(frames)
+    labels = get_terrain_classifier().classify(warped)
+    tables = get_pixel_tables(warped.shape[1:])
+    nav_binary = labels & LABEL_NAV
+    polar_stats = tables.polar_stats(nav_binary)
+    world = labels_to_world_batch(labels, tables, xpos, ypos, yaw, world_size, scale)
+    return BatchPerception(labels, polar_stats, world)
+
+# Define a function to add a stack of camera frames to a WorldMap: warp,
+# classify and project them together, skipping frames where the rover isn't
+# level. Poses are length N sequences. This is the mapping part of
+# perception_step, without a RoverState.
+def map_frames(frames, xpos, ypos, yaw, roll, pitch, world):
+    level = np.flatnonzero(level_for_mapping(roll, pitch))
+    if len(level) == 0:
+        return None
+    if len(level) < len(frames):
+        frames = frames[level]
+    xpos, ypos, yaw = [np.asarray(pose)[level] for pose in (xpos, ypos, yaw)]
+    warped = get_warp_engine(frames.shape[1:]).warp_batch(frames)
+    labels = get_terrain_classifier().classify(warped)
+    ((obs_frame, obs_x_world, obs_y_world), (rock_frame, rock_x_world, rock_y_world),
+     (nav_frame, nav_x_world, nav_y_world)) = labels_to_world_batch(
+         labels, get_pixel_tables(warped.shape[1:]), xpos, ypos, yaw, world.size, 10)
+    return world.update(((obs_x_world, obs_y_world, OBSTACLE),
+                         (rock_x_world, rock_y_world, ROCK),
+                         (nav_x_world, nav_y_world, NAVIGABLE)))
+
+# Define a function to add one camera frame to a WorldMap (the N=1 case of
+# map_frames)
+def map_frame(img, xpos, ypos, yaw, roll, pitch, world):
+    return map_frames(img[None], [xpos], [ypos], [yaw], [roll], [pitch], world)
 
 # Apply the above functions in succession and update the Rover state accordingly
 def perception_step(Rover):
     # Perform perception steps to update Rover()
     # TODO:
     # NOTE: camera image is coming to you in Rover.img
-    # 1) Define source and destination points for perspective transform
-    image = Rover.img
-    dst_size = 5
-    bottom_offset = 9
-    source = np.float32([[15, 140], [301 ,140],[200, 96], [119, 96]])
-    destination = np.float32([[image.shape[1]/2 - dst_size, image.shape[0] - bottom_offset - 1],
-                  [image.shape[1]/2 + dst_size - 1, image.shape[0] - bottom_offset - 1],
-                  [image.shape[1]/2 + dst_size - 1, image.shape[0] - 2*dst_size - bottom_offset],
-                  [image.shape[1]/2 - dst_size, image.shape[0] - 2*dst_size - bottom_offset],
-                  ])
-    # 2) Apply perspective transform to image
-    warped = perspect_transform(image, source, destination)
-    warped[152:,:,:] = 0
-    # 3) Apply color threshold to identify navigable terrain/obstacles/rock
-    #    samples in warped image
-    nav_binary = color_thresh(warped)
-    obs_binary = obs_thresh(warped)
-    rock_binary = rock_thresh(warped)
+    # 1) Look up the calibrated perspective transform (source and destination
+    #    points are fixed, so the warp engine is only built once)
+    engine = get_warp_engine(Rover.img.shape)
+    # 2) Apply perspective transform to image (rows >= 152 are masked to 0)
+    warped = engine.warp(Rover.img)
+    # 3) Classify navigable terrain/obstacles/rock samples in the warped image
+    #    in a single pass, then split the labels into per-class binary images
+    labels = get_terrain_classifier().classify(warped, out=Rover.terrain_labels)
+    nav_binary, obs_binary, rock_binary = split_labels(labels, *Rover.terrain_binary)
     # 4) Update Rover.vision_image (to be displayed on left side of screen)
     Rover.vision_image[:,:,0] = obs_binary * 255
     Rover.vision_image[:,:,1] = rock_binary * 255
     Rover.vision_image[:,:,2] = nav_binary * 255
-    # 5) Convert map image pixel values to rover-centric coordinates
-    nav_x_rov, nav_y_rov = rover_coords(nav_binary)
-    obs_x_rov, obs_y_rov = rover_coords(obs_binary)
-    rock_x_rov, rock_y_rov = rover_coords(rock_binary)
-    # 6) Convert rover-centric pixel values to world coordinates
-    nav_x_world, nav_y_world = pix_to_world(nav_x_rov, nav_y_rov, Rover.pos[0],
-                                            Rover.pos[1], Rover.yaw, 200, 10)
-    obs_x_world, obs_y_world = pix_to_world(obs_x_rov, obs_y_rov, Rover.pos[0],
-                                            Rover.pos[1], Rover.yaw, 200, 10)
-    rock_x_world, rock_y_world = pix_to_world(rock_x_rov, rock_y_rov, Rover.pos[0],
-                                            Rover.pos[1], Rover.yaw, 200, 10)
+    # Publish the features decision_step needs (rock position and alignment,
+    # pixel counts) so they are computed only once per frame
+    if Rover.features is None:
+        Rover.features = PerceptionFeatures(Rover.img.shape)
+    Rover.features.update(Rover.img, nav_binary, obs_binary, rock_binary)
+    # 5) Look up rover-centric coordinates in the precomputed per-pixel tables
+    tables = get_pixel_tables(warped.shape)
+    # 6) Convert rover-centric pixel values of all classes to world
+    #    coordinates in one batched transform
+    ((obs_x_world, obs_y_world), (rock_x_world, rock_y_world),
+     (nav_x_world, nav_y_world)) = labels_to_world(labels, tables, Rover.pos[0],
+                                                   Rover.pos[1], Rover.yaw, 200, 10)
     # 7) Update Rover worldmap (to be displayed on right side of screen)
     #    if roll and pitch are within tolerances
-    roll = Rover.roll
-    pitch = Rover.pitch
-    if (roll < 0.4 or roll > 359.6) and (pitch < 0.4 or pitch > 359.6):
-        Rover.worldmap[obs_y_world, obs_x_world, 0] += 1
-        Rover.worldmap[rock_y_world, rock_x_world, 1] += 1
-        Rover.worldmap[nav_y_world, nav_x_world, 2] += 1
+    if level_for_mapping(Rover.roll, Rover.pitch):
+        Rover.world.update(((obs_x_world, obs_y_world, OBSTACLE),
+                            (rock_x_world, rock_y_world, ROCK),
+                            (nav_x_world, nav_y_world, NAVIGABLE)))
     # 8) Convert rover-centric pixel positions to polar coordinates, and
     #    update Rover pixel distances and angles
-    Rover.nav_dists, Rover.nav_angles = to_polar_coords(nav_x_rov, nav_y_rov)
+    Rover.nav_dists, Rover.nav_angles = tables.polar(nav_binary)
     Rover.mean_dist = np.mean(Rover.nav_dists)
     Rover.mean_ang = np.mean(Rover.nav_angles)
-    Rover.local_mean_ang = np.mean(Rover.nav_angles[Rover.nav_dists < 50])
+    Rover.local_mean_ang = tables.local_mean_angle(nav_binary)
 
     return Rover
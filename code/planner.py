@@ -0,0 +1,243 @@
+import time
+import numpy as np
+import cv2
+
+from world_map import OBSTACLE, NAVIGABLE
+
+# Cell states of the planner's occupancy grid
+UNKNOWN = 0
+FREE = 1
+BLOCKED = 2
+
+# 8-connected neighbourhood, used for frontiers and the search wavefront
+KERNEL = np.ones((3, 3), dtype=np.uint8)
+NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+# Frontier-based exploration over a WorldMap. The planner keeps an occupancy
+# grid with the same rule as the map inset (a cell is free when it has
+# navigable detections at least as often as obstacle detections), updated
+# only at the cells the WorldMap changed. Frontiers are free cells next to
+# unknown ones, found with a dilation. A breadth-first wavefront grown from
+# the rover (one vectorized dilation per step, at most max_steps steps) finds
+# the nearest reachable frontier and the path to it. The path is cached and
+# only replanned when changed cells touch it, the goal stops being a
+# frontier, the goal is reached, or the rover strays from the path. After a
+# search that finds no path, the next search waits until the grid changes.
+#   clearance:    cells kept between the path and blocked cells
+#   min_frontier: frontier cells needed in the 5x5 area around a goal, so
+#                 single noisy cells are not chased
+#   lookahead:    path cells ahead of the rover to steer towards
+#   min_goal_dist: frontier cells closer than this are ignored, the unmapped
+#                 area right behind the rover is always a frontier
+#   footprint:    cells around the rover that are passable whatever the map
+#                 says (the rover is standing there)
+class ExplorationPlanner():
+    def __init__(self, size=200, clearance=1, min_frontier=3, lookahead=6,
+                 max_steps=300, goal_radius=2, max_offset=3, min_goal_dist=8,
+                 footprint=2):
+        self.size = size
+        self.clearance = clearance
+        self.min_frontier = min_frontier
+        self.lookahead = lookahead
+        self.max_steps = max_steps
+        self.goal_radius = goal_radius
+        self.max_offset = max_offset
+        self.min_goal_dist = min_goal_dist
+        self.footprint = footprint
+        rows, cols = np.mgrid[0:size, 0:size]
+        self._rows = rows
+        self._cols = cols
+        self.grid = np.zeros((size, size), dtype=np.uint8) # UNKNOWN, FREE or BLOCKED
+        self.frontier = np.zeros((size, size), dtype=bool)
+        self.frontier_density = np.zeros((size, size), dtype=np.uint16)
+        self.path = [] # (row, col) cells from the rover to the goal
+        self.path_mask = np.zeros((size, size), dtype=bool) # Cells on or near the path
+        self.goal = None
+        self.version = None # WorldMap.version the grid reflects
+        self.grid_version = 0 # Incremented when any cell changes state
+        self.frontier_version = -1 # grid_version the frontiers were found for
+        self.failed_version = None # grid_version of the last search that found no path
+        self.replans = 0
+        self.plan_time = 0 # Seconds spent in the last replan
+
+    # Bring the grid up to date with world, returns the cells that changed
+    # state (or None if the whole grid was rebuilt)
+    def update_grid(self, world):
+        if world.version == self.version:
+            return np.zeros(0, dtype=np.intp)
+        changed = world.changed
+        if self.version is None or changed is None or world.version != self.version + 1:
+            # Missed an update, or the whole map changed (decay or clear)
+            new_grid = self._classify(world.counts)
+            if not np.array_equal(new_grid, self.grid):
+                self.grid[:] = new_grid
+                self.grid_version += 1
+            self.version = world.version
+            return None
+        cells = np.unique(changed // 3)
+        counts = world.counts.reshape(-1, 3)[cells]
+        states = self._classify(counts)
+        flat_grid = self.grid.reshape(-1)
+        moved = states != flat_grid[cells]
+        cells = cells[moved]
+        if len(cells) > 0:
+            flat_grid[cells] = states[moved]
+            self.grid_version += 1
+        self.version = world.version
+        return cells
+
+    def _classify(self, counts):
+        nav = counts[..., NAVIGABLE]
+        obstacle = counts[..., OBSTACLE]
+        states = np.full(nav.shape, UNKNOWN, dtype=np.uint8)
+        states[(nav > 0) & (nav >= obstacle)] = FREE
+        states[obstacle > nav] = BLOCKED
+        return states
+
+    def update_frontiers(self):
+        if self.frontier_version == self.grid_version:
+            return self.frontier
+        unknown = (self.grid == UNKNOWN).astype(np.uint8)
+        self.frontier = (self.grid == FREE) & (cv2.dilate(unknown, KERNEL) > 0)
+        # Number of frontier cells around each cell, to rank goals
+        self.frontier_density = cv2.boxFilter(self.frontier.astype(np.uint8), cv2.CV_16U,
+                                              (5, 5), normalize=False)
+        self.frontier_version = self.grid_version
+        return self.frontier
+
+    # Cells the path may use: free cells at least clearance cells from any
+    # blocked cell
+    def passable(self):
+        free = self.grid == FREE
+        if self.clearance > 0:
+            blocked = (self.grid == BLOCKED).astype(np.uint8)
+            size = 2 * self.clearance + 1
+            near_blocked = cv2.dilate(blocked, np.ones((size, size), dtype=np.uint8)) > 0
+            free &= ~near_blocked
+        return free
+
+    # Search from the rover's cell to the nearest reachable frontier
+    def replan(self, start):
+        t0 = time.perf_counter()
+        self.replans += 1
+        self.path = []
+        self.goal = None
+        self.path_mask[:] = False
+        frontier = self.update_frontiers()
+        goals = frontier & (self.frontier_density >= self.min_frontier)
+        passable = self.passable()
+        start_dist = np.hypot(self._rows - start[0], self._cols - start[1])
+        passable |= start_dist <= self.footprint
+        goals &= passable & (start_dist >= self.min_goal_dist)
+        if goals.any():
+            # Wavefront: step[cell] is the number of moves from the start
+            step = np.full(self.grid.shape, -1, dtype=np.int16)
+            step[start] = 0
+            reached = np.zeros(self.grid.shape, dtype=np.uint8)
+            reached[start] = 1
+            passable_u8 = passable.astype(np.uint8)
+            for n_steps in range(1, self.max_steps + 1):
+                grown = cv2.dilate(reached, KERNEL) & passable_u8
+                new = (grown > 0) & (reached == 0)
+                if not new.any():
+                    break
+                step[new] = n_steps
+                reached |= new
+                found = new & goals
+                if found.any():
+                    # Of the nearest goals, take the one on the largest frontier
+                    rows, cols = np.nonzero(found)
+                    best = np.argmax(self.frontier_density[rows, cols])
+                    self.goal = (rows[best], cols[best])
+                    self.path = self._trace(step, self.goal)
+                    break
+        if self.path:
+            for row, col in self.path:
+                self.path_mask[row, col] = True
+            if self.clearance > 0:
+                size = 2 * self.clearance + 1
+                self.path_mask = cv2.dilate(self.path_mask.astype(np.uint8),
+                                            np.ones((size, size), dtype=np.uint8)) > 0
+            self.failed_version = None
+        else:
+            self.failed_version = self.grid_version
+        self.plan_time = time.perf_counter() - t0
+        return self.path
+
+    # Walk back from the goal along decreasing wavefront steps
+    def _trace(self, step, goal):
+        path = [goal]
+        row, col = goal
+        while step[row, col] > 0:
+            for d_row, d_col in NEIGHBOURS:
+                n_row, n_col = row + d_row, col + d_col
+                if (0 <= n_row < self.size and 0 <= n_col < self.size
+                        and step[n_row, n_col] == step[row, col] - 1):
+                    row, col = n_row, n_col
+                    break
+            path.append((row, col))
+        path.reverse()
+        return path
+
+    # Drop the path cells the rover has passed, returns the distance (cells)
+    # from the rover to the path
+    def _advance(self, cell):
+        path = np.array(self.path)
+        dists = np.hypot(path[:, 0] - cell[0], path[:, 1] - cell[1])
+        nearest = int(np.argmin(dists))
+        self.path = self.path[nearest:]
+        return dists[nearest]
+
+    # Update the plan with the latest world map and rover position, returns
+    # the (x, y) world position of the next waypoint, or None if there is no
+    # reachable frontier
+    def waypoint(self, world, pos):
+        cell = (int(np.clip(pos[1], 0, self.size - 1)), int(np.clip(pos[0], 0, self.size - 1)))
+        changed = self.update_grid(world)
+        if not self.path and self.failed_version == self.grid_version:
+            # The last search found no reachable frontier and nothing changed since
+            return None
+        replan = not self.path
+        if not replan and changed is None:
+            replan = True
+        elif not replan:
+            # Cells on or next to the path that stopped being free (cells
+            # becoming free can only open up shortcuts, so they are ignored)
+            lost = changed[self.grid.reshape(-1)[changed] != FREE]
+            replan = self.path_mask.reshape(-1)[lost].any()
+        if not replan:
+            replan = not self.update_frontiers()[self.goal]
+        if not replan:
+            offset = self._advance(cell)
+            goal_dist = np.hypot(self.goal[0] - cell[0], self.goal[1] - cell[1])
+            replan = offset > self.max_offset or goal_dist <= self.goal_radius
+        if replan:
+            self.replan(cell)
+            if self.path:
+                self._advance(cell)
+        if not self.path:
+            return None
+        row, col = self.path[min(self.lookahead, len(self.path) - 1)]
+        return col + 0.5, row + 0.5
+
+    # Steering angle (degrees) towards the next waypoint, limited to the range
+    # of navigable terrain currently in view, or None without a waypoint
+    def steer(self, Rover, max_steer=15):
+        target = self.waypoint(Rover.world, Rover.pos)
+        if target is None:
+            return None
+        yaw_rad = Rover.yaw * np.pi / 180
+        d_x, d_y = target[0] - Rover.pos[0], target[1] - Rover.pos[1]
+        ahead = d_x * np.cos(yaw_rad) + d_y * np.sin(yaw_rad)
+        left = -d_x * np.sin(yaw_rad) + d_y * np.cos(yaw_rad)
+        angle = np.arctan2(left, ahead) * 180 / np.pi
+        if Rover.nav_angles is not None and len(Rover.nav_angles) > 0:
+            low, high = np.percentile(Rover.nav_angles, [10, 90]) * 180 / np.pi
+            angle = np.clip(angle, low, high)
+        return float(np.clip(angle, -max_steer, max_steer))
+
+    # Summary of the planner state
+    def stats(self):
+        return {'replans': self.replans, 'plan_ms': round(self.plan_time * 1000, 3),
+                'path_length': len(self.path), 'goal': self.goal,
+                'frontier_cells': int(np.count_nonzero(self.frontier))}
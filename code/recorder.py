@@ -0,0 +1,110 @@
+import os
+import queue
+import threading
+from datetime import datetime
+
+from dataset import ROBOT_LOG_COLUMNS
+from rover_log import logger
+
+# Records an autonomous run in the same layout as the simulator's "Training
+# Mode" recordings: camera frames in <folder>/IMG and a semicolon separated
+# <folder>/robot_log.csv, so the offline tools can replay it.
+# record() only queues work; a pool of writer threads saves the JPEGs and a
+# single log thread appends the csv rows in frame order. If the disk falls
+# behind, the recorder first backs off to recording every 2nd, 4th, ... frame
+# (up to max_stride) and drops frames outright when the queue is full.
+class FrameRecorder():
+    def __init__(self, folder, max_queue=128, n_writers=2, max_stride=8):
+        self.folder = folder
+        self.image_folder = os.path.join(folder, 'IMG')
+        os.makedirs(self.image_folder, exist_ok=True)
+        self.max_queue = max_queue
+        self.max_stride = max_stride
+        self.stride = 1 # Record every stride-th frame
+        self.frame = 0
+        self.recorded = 0 # Frames queued for writing
+        self.written = 0 # Frames saved to disk
+        self.skipped = 0 # Frames not recorded while backing off
+        self.dropped = 0 # Frames dropped because the queue was full
+        self.last_name = None
+        self._images = queue.Queue(maxsize=max_queue)
+        self._rows = queue.Queue()
+        self._lock = threading.Lock()
+        self._log_file = open(os.path.join(folder, 'robot_log.csv'), 'w', newline='')
+        self._log_file.write(';'.join(ROBOT_LOG_COLUMNS) + '\n')
+        self._writers = [threading.Thread(target=self._write_images, daemon=True)
+                         for idx in range(n_writers)]
+        self._log_writer = threading.Thread(target=self._write_rows, daemon=True)
+        for thread in self._writers + [self._log_writer]:
+            thread.start()
+
+    # Queue the current camera frame (raw JPEG bytes) and telemetry of Rover.
+    # Returns True if the frame will be recorded.
+    def record(self, jpeg_bytes, Rover):
+        self.frame += 1
+        self._adjust_stride()
+        if self.frame % self.stride != 0:
+            self.skipped += 1
+            return False
+        timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+        name = 'robocam_{}.jpg'.format(timestamp)
+        if name == self.last_name:
+            # Two frames within the same millisecond
+            name = 'robocam_{}_{}.jpg'.format(timestamp, self.frame)
+        path = os.path.abspath(os.path.join(self.image_folder, name))
+        try:
+            self._images.put_nowait((path, jpeg_bytes))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Recording is falling behind, %d frames dropped so far", self.dropped)
+            return False
+        self.last_name = name
+        values = [Rover.steer, Rover.throttle, Rover.brake, Rover.vel,
+                  Rover.pos[0], Rover.pos[1], Rover.pitch, Rover.yaw, Rover.roll]
+        self._rows.put(';'.join([path] + [str(float(value)) for value in values]) + '\n')
+        self.recorded += 1
+        return True
+
+    def _adjust_stride(self):
+        backlog = self._images.qsize()
+        if backlog > self.max_queue * 3 // 4 and self.stride < self.max_stride:
+            self.stride *= 2
+        elif backlog < self.max_queue // 4 and self.stride > 1:
+            self.stride //= 2
+
+    def _write_images(self):
+        while True:
+            job = self._images.get()
+            if job is None:
+                return
+            path, jpeg_bytes = job
+            try:
+                with open(path, 'wb') as image_file:
+                    image_file.write(jpeg_bytes)
+                with self._lock:
+                    self.written += 1
+            except OSError:
+                logger.exception("Could not save frame %s", path)
+
+    def _write_rows(self):
+        while True:
+            row = self._rows.get()
+            if row is None:
+                self._log_file.close()
+                return
+            self._log_file.write(row)
+
+    # Summary of the recording counters
+    def stats(self):
+        return {'frames': self.frame, 'recorded': self.recorded, 'written': self.written,
+                'skipped': self.skipped, 'dropped': self.dropped}
+
+    # Finish writing everything that is queued, then stop the threads
+    def close(self):
+        for thread in self._writers:
+            self._images.put(None)
+        for thread in self._writers:
+            thread.join()
+        self._rows.put(None)
+        self._log_writer.join()
+        return self.stats()
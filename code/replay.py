@@ -0,0 +1,82 @@
+# Replay a recorded run through the full perception -> decision ->
+# create_output_images pipeline without the simulator, as fast as possible.
+# Example: $ python replay.py ../test_dataset
+import argparse
+import time
+import numpy as np
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import create_output_images
+from rover_state import RoverState
+from dataset import open_run, apply_telemetry
+from instrumentation import StageTimer
+from planner import ExplorationPlanner
+
+# Define a function to replay a run, returning the final Rover and a
+# StageTimer holding the latency of every stage of every frame
+def replay(run, Rover=None, start=0, limit=None, output_images=True):
+    if Rover is None:
+        Rover = RoverState()
+    stop = len(run) if limit is None else min(start + limit, len(run))
+    timer = StageTimer(window=max(stop - start, 1))
+    times = run.telemetry['time']
+    start_time = times[start] if stop > start else 0
+    for idx in range(start, stop):
+        t0 = time.perf_counter()
+        Rover.img = run.frame(idx)
+        apply_telemetry(Rover, run.telemetry[idx])
+        if Rover.start_time is None:
+            Rover.start_time = time.time()
+            Rover.start_pos = list(Rover.pos)
+            # Recorded runs don't include sample positions
+            Rover.samples_pos = (np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int_))
+        Rover.total_time = times[idx] - start_time if np.isfinite(times[idx]) else 0
+        t1 = time.perf_counter()
+        Rover = perception_step(Rover)
+        t2 = time.perf_counter()
+        Rover = decision_step(Rover)
+        t3 = time.perf_counter()
+        if output_images:
+            create_output_images(Rover)
+        t4 = time.perf_counter()
+        timer.record('load', t1 - t0)
+        timer.record('perception', t2 - t1)
+        timer.record('decision', t3 - t2)
+        timer.record('output', t4 - t3)
+        timer.record('total', t4 - t0)
+    return Rover, timer
+
+def print_report(Rover, timer):
+    summary = timer.summary()
+    n_frames = summary['total']['count'] if 'total' in summary else 0
+    total = n_frames * summary['total']['mean'] / 1000 if n_frames else 0
+    print('Frames: {}  Total: {:.3f} s  Throughput: {:.1f} frames/s'.format(
+          n_frames, total, n_frames / total if total > 0 else float('nan')))
+    print(timer.format_report())
+    print('Mapped: {}%  Fidelity: {}%  Rocks located: {}'.format(
+          Rover.perc_mapped, Rover.fidelity, Rover.samples_located))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline replay of a recorded run')
+    parser.add_argument(
+        'run',
+        type=str,
+        nargs='?',
+        default='../test_dataset',
+        help='Recorded run: a folder containing robot_log.csv (or the csv itself), or a packed run folder.'
+    )
+    parser.add_argument('--start', type=int, default=0, help='Index of the first frame to replay.')
+    parser.add_argument('--limit', type=int, default=None, help='Replay at most this many frames.')
+    parser.add_argument('--no-output-images', action='store_true',
+                        help='Skip create_output_images.')
+    parser.add_argument('--explore', action='store_true',
+                        help='Run the exploration planner in decision_step.')
+    args = parser.parse_args()
+
+    Rover = RoverState()
+    if args.explore:
+        Rover.planner = ExplorationPlanner(Rover.world.size)
+    Rover, timer = replay(open_run(args.run), Rover, start=args.start, limit=args.limit,
+                          output_images=not args.no_output_images)
+    print_report(Rover, timer)
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+# Logger for everything the rover reports. Records are handed to a queue and
+# written by a background thread (see setup_logging), so the control loop
+# never blocks on stdout or disk.
+logger = logging.getLogger('rover')
+
+# Drop repeats of the same message that arrive faster than max_rate per second
+# (0 disables the limit). Messages are told apart by their format string, so
+# per-frame messages are limited whatever their arguments; messages about one
+# connection pass extra={'rate_key': sid} to be limited per connection
+# instead. Runs in the caller's thread before queuing, so suppressed records
+# cost almost nothing.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, max_rate=1.0, max_keys=1024):
+        super().__init__()
+        self.interval = 1.0 / max_rate if max_rate > 0 else 0
+        self.max_keys = max_keys
+        self.last_emit = {}
+
+    def filter(self, record):
+        if self.interval == 0:
+            return True
+        key = (record.name, record.msg, getattr(record, 'rate_key', None))
+        now = time.monotonic()
+        last = self.last_emit.get(key)
+        if last is not None and now - last < self.interval:
+            return False
+        if last is None and len(self.last_emit) >= self.max_keys:
+            # Forget messages that are no longer being limited (e.g. ones
+            # about connections that have closed)
+            self.last_emit = {old_key: emitted for old_key, emitted in self.last_emit.items()
+                              if now - emitted < self.interval}
+        self.last_emit[key] = now
+        return True
+
+# Formats records as "time level name message key=value ...", taking the
+# key/value pairs from the `fields` dict passed as extra={'fields': {...}}
+class StructuredFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join('{}={}'.format(key, value) for key, value in fields.items())
+        return line
+
+# Define a function to configure rover logging. level is a logging level name
+# or number, max_rate limits each message to that many records per second and
+# log_file sends output to a file instead of stderr. Returns the listener
+# running the background writer.
+def setup_logging(level='WARNING', max_rate=1.0, log_file=None):
+    if log_file:
+        handler = logging.FileHandler(log_file)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+    record_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(record_queue)
+    queue_handler.addFilter(RateLimitFilter(max_rate))
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(record_queue, handler)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(stop_listener, listener)
+    return listener
+
+def stop_listener(listener):
+    # QueueListener.stop() fails if called twice
+    if listener._thread is not None:
+        listener.stop()
@@ -0,0 +1,214 @@
+import os
+import signal
+import threading
+import multiprocessing
+import numpy as np
+
+from perception import perception_step, configure_terrain_classifier, get_terrain_classifier
+from decision import decision_step
+from supporting_functions import update_rover, update_map_statistics
+from rover_state import RoverState
+from instrumentation import NullTimer
+from rover_log import logger, setup_logging
+from inset_encoder import InsetEncoder
+from recorder import FrameRecorder
+from planner import ExplorationPlanner
+
+# The perception caches (warp output, classifier index buffer, ...) are
+# shared by every Rover in a process, so sessions of the same process take
+# turns running the pipeline
+pipeline_lock = threading.Lock()
+
+# Action sent back when a frame cannot be processed: zeros for throttle,
+# brake and steer and empty images. The simulator only sends the next
+# telemetry after a reply, so every frame must be answered.
+NULL_ACTION = ('control', (0, 0, 0), '', '')
+
+# Everything one simulator connection needs: its own Rover, inset encoder
+# and recorder. number counts sessions in the order they started; session 0
+# records into record_folder itself, later ones into record_folder/rover_<n>.
+#   options: inset_every, inset_hz, sync_insets, record_folder,
+#            record_queue, record_writers and explore (see drive_rover.py)
+class RoverSession():
+    def __init__(self, number=0, options=None, timer=None):
+        options = options or {}
+        self.number = number
+        self.timer = timer if timer is not None else NullTimer()
+        self.Rover = RoverState()
+        if options.get('explore'):
+            self.Rover.planner = ExplorationPlanner(self.Rover.world.size)
+        self.inset_encoder = InsetEncoder(every_n_frames=options.get('inset_every', 1),
+                                          max_hz=options.get('inset_hz'),
+                                          background=not options.get('sync_insets', False))
+        self.recorder = None
+        if options.get('record_folder'):
+            folder = options['record_folder']
+            if number > 0:
+                folder = os.path.join(folder, 'rover_{}'.format(number))
+            self.recorder = FrameRecorder(folder, max_queue=options.get('record_queue', 128),
+                                          n_writers=options.get('record_writers', 2))
+
+    # Define a function to run one telemetry message through the rover
+    # pipeline and return the action to send back: ('pickup',) or
+    # ('control', commands, image_string1, image_string2)
+    def process(self, data):
+        with pipeline_lock:
+            return self._process(data)
+
+    def _process(self, data):
+        timer = self.timer
+        Rover = self.Rover
+        # Initialize / update Rover with current telemetry
+        try:
+            with timer.stage('update_rover'):
+                Rover = update_rover(Rover, data)
+        except ValueError as err:
+            # Malformed telemetry, send null commands and wait for the next frame
+            logger.warning("Ignoring telemetry: %s", err)
+            return NULL_ACTION
+
+        if np.isfinite(Rover.vel):
+
+            # Execute the perception and decision steps to update the Rover's state
+            with timer.stage('perception'):
+                Rover = perception_step(Rover)
+            with timer.stage('decision'):
+                Rover = decision_step(Rover)
+
+            # Update the map statistics, then pick up the latest output
+            # images to send to server (encoded in the background)
+            with timer.stage('map_statistics'):
+                Rover = update_map_statistics(Rover)
+            with timer.stage('output_images'):
+                out_image_string1, out_image_string2 = self.inset_encoder.update(Rover)
+
+            # Don't send both pickup and control commands, they both trigger the
+            # simulator to send back new telemetry so we must only send one
+            # back in respose to the current telemetry data.
+
+            # If in a state where want to pickup a rock send pickup command
+            if Rover.send_pickup and not Rover.picking_up:
+                action = ('pickup',)
+                # Reset Rover flags
+                Rover.send_pickup = False
+            else:
+                action = ('control', (Rover.throttle, Rover.brake, Rover.steer),
+                          out_image_string1, out_image_string2)
+
+        # In case of invalid telemetry, send null commands
+        else:
+
+            # Send zeros for throttle, brake and steer and empty images
+            action = NULL_ACTION
+
+        # If you want to save camera images from autonomous driving specify a path
+        # Example: $ python drive_rover.py image_folder_path
+        # Conditional to save image frame if folder was specified (the frame
+        # and telemetry are only queued here, writing happens in the background)
+        if self.recorder is not None:
+            with timer.stage('record'):
+                self.recorder.record(Rover.img_jpeg, Rover)
+
+        timer.frame_done()
+        return action
+
+    # Stop the background threads, returns the recording counters (if any)
+    def close(self):
+        self.inset_encoder.close()
+        if self.recorder is not None:
+            return self.recorder.close()
+        return None
+
+# Define a function to serve the sessions assigned to one worker process of
+# a SessionPool, answering requests from its pipe until told to stop
+def _serve(conn, options, thresholds, log_options):
+    # Ctrl+C is handled by the server, which then stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(**log_options)
+    if thresholds:
+        configure_terrain_classifier(**thresholds)
+    else:
+        get_terrain_classifier()
+    sessions = {}
+    while True:
+        command, sid, payload = conn.recv()
+        try:
+            if command == 'open':
+                sessions[sid] = RoverSession(payload, options)
+                reply = None
+            elif command == 'process':
+                reply = sessions[sid].process(payload)
+            elif command == 'close':
+                session = sessions.pop(sid, None)
+                reply = session.close() if session is not None else None
+            else:
+                for session in sessions.values():
+                    session.close()
+                conn.send(None)
+                return
+        except Exception:
+            logger.exception("Session %s failed to handle %s", sid, command,
+                             extra={'rate_key': sid})
+            reply = NULL_ACTION if command == 'process' else None
+        conn.send(reply)
+
+# Spreads rover sessions over worker processes so several simulators can be
+# driven in parallel. A session stays in the process it was first assigned
+# (the least loaded one) for its whole life, since its Rover lives there.
+# process() blocks until the worker answers, so call it from a native thread
+# (e.g. through FrameWorker, which uses eventlet.tpool).
+class SessionPool():
+    def __init__(self, n_processes, options=None, thresholds=None, log_options=None):
+        context = multiprocessing.get_context('spawn')
+        self.workers = []
+        for idx in range(n_processes):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_serve, daemon=True,
+                                      args=(child_conn, options or {}, thresholds,
+                                            log_options or {}))
+            process.start()
+            self.workers.append((conn, threading.Lock(), process))
+        self.assignments = {} # sid -> worker index
+        self.sessions = 0 # Sessions started so far
+        self._lock = threading.Lock()
+
+    def _call(self, idx, command, sid, payload=None):
+        conn, lock, process = self.workers[idx]
+        with lock:
+            conn.send((command, sid, payload))
+            return conn.recv()
+
+    def _assign(self, sid):
+        with self._lock:
+            idx = self.assignments.get(sid)
+            if idx is not None:
+                return idx, None
+            loads = [0] * len(self.workers)
+            for assigned in self.assignments.values():
+                loads[assigned] += 1
+            idx = int(np.argmin(loads))
+            self.assignments[sid] = idx
+            number = self.sessions
+            self.sessions += 1
+            return idx, number
+
+    # Run a telemetry message through the session of sid, returns the action
+    def process(self, sid, data):
+        idx, number = self._assign(sid)
+        if number is not None:
+            self._call(idx, 'open', sid, number)
+        return self._call(idx, 'process', sid, data)
+
+    # End the session of sid, returns its recording counters (if any)
+    def close_session(self, sid):
+        with self._lock:
+            idx = self.assignments.pop(sid, None)
+        if idx is None:
+            return None
+        return self._call(idx, 'close', sid)
+
+    def close(self):
+        for idx, (conn, lock, process) in enumerate(self.workers):
+            self._call(idx, 'stop', None)
+            process.join()
+        self.workers = []
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import matplotlib.image as mpimg
+
+from world_map import WorldMap, MapStatistics
+from telemetry import TelemetryDecoder
+from supporting_functions import MapInsetCache
+
+# Read in ground truth map and create 3-channel green version for overplotting
+# NOTE: images are read in by default with the origin (0, 0) in the upper left
+# and y-axis increasing downward.
+ground_truth = mpimg.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                          '..', 'calibration_images', 'map_bw.png'))
+# This next line creates arrays of zeros in the red and blue channels
+# and puts the map into the green channel.  This is why the underlying
+# map output looks green in the display image
+ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.float)
+
+# Define RoverState() class to retain rover state parameters
+class RoverState():
+    def __init__(self):
+        self.start_time = None # To record the start time of navigation
+        self.total_time = None # To record total duration of naviagation
+        self.img = None # Current camera image
+        self.img_jpeg = None # Current camera image as received (JPEG bytes)
+        self.pos = None # Current position (x, y)
+        self.start_pos = None # Starting position (x, y)
+        self.yaw = None # Current yaw angle
+        self.pitch = None # Current pitch angle
+        self.roll = None # Current roll angle
+        self.vel = None # Current velocity
+        self.steer = 0 # Current steering angle
+        self.throttle = 0 # Current throttle value
+        self.brake = 0 # Current brake value
+        self.nav_angles = None # Angles of navigable terrain pixels
+        self.nav_dists = None # Distances of navigable terrain pixels
+        self.mean_dist = None
+        self.mean_ang = None
+        self.local_mean_ang = None
+        self.ground_truth = ground_truth_3d # Ground truth worldmap
+        self.mode = 'forward' # Current mode (can be forward or stop)
+        self.throttle_set = 0.2 # Throttle setting when accelerating
+        self.brake_set = 10 # Brake setting when braking
+        # The stop_forward and go_forward fields below represent total count
+        # of navigable terrain pixels.  This is a very crude form of knowing
+        # when you can keep going and when you should stop.  Feel free to
+        # get creative in adding new fields or modifying these!
+        self.stop_forward = 15 # Threshold to initiate stopping
+        self.go_forward = 20 # Threshold to go forward again
+        self.max_vel = 1.2 # Maximum velocity (meters/second)
+        # Image output from perception step
+        # Update this image to display your intermediate analysis steps
+        # on screen in autonomous mode
+        self.vision_image = np.zeros((160, 320, 3), dtype=np.float)
+        # Per pixel terrain labels of the warped image (see perception.py)
+        # and the navigable, obstacle and rock binary images split from them
+        self.terrain_labels = np.zeros((160, 320), dtype=np.uint8)
+        self.terrain_binary = np.zeros((3, 160, 320), dtype=np.uint8)
+        self.features = None # Per-frame perception features for decision making
+        # Worldmap
+        # Update this image with the positions of navigable terrain
+        # obstacles and rock samples
+        self.world = WorldMap(200)
+        # Detection counts of the world map (channels are obstacle, rock and
+        # navigable), updated in place by self.world
+        self.worldmap = self.world.counts
+        self.head_home = False
+        self.samples_pos = None # To store the actual sample positions
+        self.samples_to_find = 0 # To store the initial count of samples
+        self.samples_located = 0 # To store number of samples located on map
+        self.map_stats = MapStatistics(ground_truth_3d) # Incremental map statistics
+        self.map_inset = MapInsetCache() # Last rendered map inset
+        self.sample_locator = None # Spatial index of the samples, built from samples_pos
+        self.located_samples = [] # Indices of the samples located on the map
+        self.perc_mapped = 0 # Percentage of the ground truth map found
+        self.fidelity = 0 # Percentage of mapped navigable pixels that are correct
+        self.samples_collected = 0 # To count the number of samples collected
+        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
+        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
+        self.send_pickup = False # Set to True to trigger rock pickup
+        self.telemetry_decoder = TelemetryDecoder() # Parses telemetry messages
+        self.planner = None # Exploration planner steering towards frontiers, if enabled
@@ -0,0 +1,178 @@
+# Headless stand-in for the simulator: replays the frames and telemetry of a
+# recorded run against a running drive_rover.py server and measures the
+# round-trip latency of each reply, the reply throughput and the frames that
+# were never answered. Each telemetry message carries a frame_id that the
+# server echoes back, so replies are matched to frames exactly.
+# Example: $ python drive_rover.py --pipelined
+#          $ python sim_client.py ../test_dataset --rate 20 --duration 10
+#          $ python sim_client.py ../test_dataset --sweep 10,20,40,80,160
+import argparse
+import json
+import threading
+import time
+import numpy as np
+import socketio
+
+from dataset import open_run, telemetry_message
+
+# Replays a run against the server. rate is the number of telemetry messages
+# sent per second; with rate 0 the client runs closed loop like the real
+# simulator, sending the next frame as soon as the previous one is answered
+# (or after reply_timeout seconds without an answer).
+class SimClient():
+    def __init__(self, url, messages, reply_timeout=1.0):
+        self.url = url
+        self.messages = messages
+        self.reply_timeout = reply_timeout
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('data', self._on_data)
+        self.client.on('pickup', self._on_pickup)
+        self.client.on('manual', self._on_manual)
+        self._lock = threading.Lock()
+        self._answered = threading.Event()
+        self.next_id = 0 # frame ids keep increasing over all runs of the client
+        self.reset()
+
+    # Start a new run. Ids of earlier runs are never reused, so their late
+    # replies count as unmatched instead of being timed against a new frame.
+    def reset(self):
+        with self._lock:
+            self.sent = {} # frame_id -> send time, for frames of this run
+            self.latencies = [] # Seconds from send to reply, per answered frame
+            self.replies = 0 # data and pickup replies, including unmatched ones
+            self.pickups = 0
+            self.manual = 0
+            self.unmatched = 0 # Replies without a frame_id of this run
+            self.first_id = self.next_id
+
+    def connect(self):
+        self.client.connect(self.url)
+
+    def close(self):
+        self.client.disconnect()
+
+    def _on_reply(self, data):
+        now = time.perf_counter()
+        with self._lock:
+            self.replies += 1
+            sent = self.sent.pop(data.get('frame_id'), None) if data else None
+            if sent is None:
+                self.unmatched += 1
+            else:
+                self.latencies.append(now - sent)
+        self._answered.set()
+
+    def _on_data(self, data):
+        self._on_reply(data)
+
+    def _on_pickup(self, data):
+        with self._lock:
+            self.pickups += 1
+        self._on_reply(data)
+
+    def _on_manual(self, data):
+        with self._lock:
+            self.manual += 1
+
+    def send_next(self):
+        with self._lock:
+            frame_id = self.next_id
+            self.next_id += 1
+            message = dict(self.messages[(frame_id - self.first_id) % len(self.messages)])
+            message['frame_id'] = frame_id
+            self._answered.clear()
+            self.sent[frame_id] = time.perf_counter()
+        self.client.emit('telemetry', message)
+
+    # Send telemetry for duration seconds, then wait up to reply_timeout for
+    # the last replies. Returns the statistics of the run.
+    def run(self, rate, duration):
+        self.reset()
+        t_start = time.perf_counter()
+        t_stop = t_start + duration
+        while time.perf_counter() < t_stop:
+            self.send_next()
+            if rate > 0:
+                # Open loop: keep to the schedule whatever the server does
+                delay = t_start + self.n_sent() / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                self._answered.wait(self.reply_timeout)
+        elapsed = time.perf_counter() - t_start
+        deadline = time.perf_counter() + self.reply_timeout
+        while self.sent and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        return self.stats(rate, elapsed)
+
+    # Frames sent in this run
+    def n_sent(self):
+        return self.next_id - self.first_id
+
+    def stats(self, rate, elapsed):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            result = {'rate': rate, 'seconds': round(elapsed, 3), 'sent': self.n_sent(),
+                      'answered': len(self.latencies), 'dropped': len(self.sent),
+                      'unmatched': self.unmatched, 'pickups': self.pickups,
+                      'manual': self.manual,
+                      'send_rate': round(self.n_sent() / elapsed, 2),
+                      'reply_rate': round(self.replies / elapsed, 2)}
+        if len(latencies) > 0:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            result.update({'mean_ms': round(float(latencies.mean()), 3),
+                           'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3),
+                           'p99_ms': round(float(p99), 3),
+                           'max_ms': round(float(latencies.max()), 3)})
+        return result
+
+# Define a function to build the telemetry messages for frames of a run
+def build_messages(run, start=0, limit=None):
+    stop = len(run) if limit is None else min(start + limit, len(run))
+    return [telemetry_message(run, idx) for idx in range(start, stop)]
+
+def print_results(results):
+    columns = ['rate', 'sent', 'answered', 'dropped', 'unmatched', 'send_rate', 'reply_rate',
+               'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    print(' '.join('{:>10}'.format(column) for column in columns))
+    for result in results:
+        print(' '.join('{:>10}'.format(result.get(column, '-')) for column in columns))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run against drive_rover.py')
+    parser.add_argument(
+        'run',
+        type=str,
+        nargs='?',
+        default='../test_dataset',
+        help='Recorded run: a folder containing robot_log.csv (or the csv itself), or a packed run folder.'
+    )
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:4567', help='drive_rover.py server.')
+    parser.add_argument('--start', type=int, default=0, help='Index of the first frame to replay.')
+    parser.add_argument('--limit', type=int, default=None, help='Replay at most this many frames (then loop).')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Telemetry messages per second, 0 to send each frame when the previous one is answered.')
+    parser.add_argument('--sweep', type=str, default=None,
+                        help='Comma separated rates to run one after the other, to find the saturation point.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to send telemetry at each rate.')
+    parser.add_argument('--reply-timeout', type=float, default=1.0,
+                        help='Seconds to wait for a reply before counting the frame as dropped.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    rates = [float(rate) for rate in args.sweep.split(',')] if args.sweep else [args.rate]
+    sim = SimClient(args.url, build_messages(open_run(args.run), args.start, args.limit),
+                    args.reply_timeout)
+    sim.connect()
+    results = []
+    try:
+        for rate in rates:
+            results.append(sim.run(rate, args.duration))
+            print_results(results[-1:])
+    finally:
+        sim.close()
+    if len(results) > 1:
+        print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
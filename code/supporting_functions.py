@@ -4,145 +4,187 @@ from PIL import Image
 from io import BytesIO, StringIO
 import base64
 import time
+import logging
+from rover_log import logger
+from world_map import SampleLocator
 
-# Define a function to convert telemetry strings to float independent of decimal convention
-def convert_to_float(string_to_convert):
-      if ',' in string_to_convert:
-            float_value = np.float(string_to_convert.replace(',','.'))
-      else:
-            float_value = np.float(string_to_convert)
-      return float_value
+# Define a function to decode a base64 JPEG camera frame into a contiguous
+# RGB uint8 array. The JPEG bytes are decoded straight from a np.frombuffer
+# view and converted to RGB into out, which is reused when its shape matches.
+# Returns the RGB array and the raw JPEG bytes.
+def decode_camera_image(img_string, out=None):
+      jpeg_bytes = base64.b64decode(img_string)
+      bgr = cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8),
+                         cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+      if bgr is None:
+            raise ValueError('Could not decode camera image')
+      if out is None or out.shape != bgr.shape or not out.flags.writeable:
+            out = np.empty_like(bgr)
+      cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out)
+      return out, jpeg_bytes
 
+# Define a function to update the Rover with a telemetry message. The camera
+# frame is kept both decoded (Rover.img) and as the raw JPEG bytes
+# (Rover.img_jpeg) that the recorder writes.
 def update_rover(Rover, data):
+      # Parse all numeric telemetry fields in one pass (raises ValueError
+      # if the message is malformed)
+      fields = Rover.telemetry_decoder.decode(data)
       # Initialize start time, sample positions, and start position
       if Rover.start_time == None:
             Rover.start_time = time.time()
             Rover.total_time = 0
-            Rover.start_pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
-            samples_xpos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_x"].split(';')])
-            samples_ypos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_y"].split(';')])
-            Rover.samples_pos = (samples_xpos, samples_ypos)
-            Rover.samples_to_find = np.int(data["sample_count"])
+            Rover.start_pos = list(fields['position'])
+            Rover.samples_pos = Rover.telemetry_decoder.decode_samples(data)
+            Rover.samples_to_find = fields['sample_count']
       # Or just update elapsed time
       else:
             tot_time = time.time() - Rover.start_time
             if np.isfinite(tot_time):
                   Rover.total_time = tot_time
-      # Print out the fields in the telemetry data dictionary
-      print(data.keys())
       # The current speed of the rover in m/s
-      Rover.vel = convert_to_float(data["speed"])
+      Rover.vel = fields['speed']
       # The current position of the rover
-      Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
+      Rover.pos = fields['position']
       # The current yaw angle of the rover
-      Rover.yaw = convert_to_float(data["yaw"])
+      Rover.yaw = fields['yaw']
       # The current yaw angle of the rover
-      Rover.pitch = convert_to_float(data["pitch"])
+      Rover.pitch = fields['pitch']
       # The current yaw angle of the rover
-      Rover.roll = convert_to_float(data["roll"])
+      Rover.roll = fields['roll']
       # The current throttle setting
-      Rover.throttle = convert_to_float(data["throttle"])
+      Rover.throttle = fields['throttle']
       # The current steering angle
-      Rover.steer = convert_to_float(data["steering_angle"])
+      Rover.steer = fields['steering_angle']
       # Near sample flag
-      Rover.near_sample = np.int(data["near_sample"])
+      Rover.near_sample = fields['near_sample']
       # Picking up flag
-      Rover.picking_up = np.int(data["picking_up"])
+      Rover.picking_up = fields['picking_up']
       # Update number of rocks collected
-      Rover.samples_collected = Rover.samples_to_find - np.int(data["sample_count"])
+      Rover.samples_collected = Rover.samples_to_find - fields['sample_count']
 
-      print('speed =',Rover.vel, 'position =', Rover.pos, 'throttle =',
-      Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
-      'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup,
-      'total time:', Rover.total_time, 'samples remaining:', data["sample_count"],
-      'samples collected:', Rover.samples_collected)
+      # Per-frame status is only assembled when debug logging is enabled
+      if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('telemetry fields', extra={'fields': {'keys': list(data.keys())}})
+            logger.debug('rover status', extra={'fields': {
+                  'speed': Rover.vel, 'position': Rover.pos, 'throttle': Rover.throttle,
+                  'steer_angle': Rover.steer, 'near_sample': Rover.near_sample,
+                  'picking_up': data["picking_up"], 'sending_pickup': Rover.send_pickup,
+                  'total_time': Rover.total_time, 'samples_remaining': data["sample_count"],
+                  'samples_collected': Rover.samples_collected}})
 
-      # Get the current image from the center camera of the rover
-      imgString = data["image"]
-      image = Image.open(BytesIO(base64.b64decode(imgString)))
-      Rover.img = np.asarray(image)
+      # Get the current image from the center camera of the rover, decoding
+      # into the previous frame's buffer
+      Rover.img, jpeg_bytes = decode_camera_image(data["image"], out=Rover.img)
+      Rover.img_jpeg = jpeg_bytes
 
-      # Return updated Rover and separate image for optional saving
-      return Rover, image
+      # Return updated Rover
+      return Rover
 
-# Define a function to create display output given worldmap results
-def create_output_images(Rover):
+# Everything needed to draw the two inset images, captured from a Rover.
+# With copy=True the arrays are copied so the snapshot can be rendered on
+# another thread while the Rover moves on to the next frame.
+class OutputSnapshot():
+      def __init__(self, Rover, copy=False):
+            self.worldmap = Rover.worldmap.copy() if copy else Rover.worldmap
+            self.world_version = Rover.world.version
+            self.located = Rover.located_samples
+            self.samples_pos = Rover.samples_pos
+            self.ground_truth = Rover.ground_truth
+            self.vision_image = Rover.vision_image.copy() if copy else Rover.vision_image
+            self.total_time = Rover.total_time
+            self.perc_mapped = Rover.perc_mapped
+            self.fidelity = Rover.fidelity
+            self.samples_collected = Rover.samples_collected
+            self.local_mean_ang = Rover.local_mean_ang
+            self.steer = Rover.steer
+            self.throttle = Rover.throttle
+            self.brake = Rover.brake
+            self.mode = Rover.mode
+            self.vel = Rover.vel
+
+# Holds the last rendered map inset (before text is added), so it is only
+# redrawn when the worldmap or the located samples have changed
+class MapInsetCache():
+      def __init__(self):
+            self.key = None
+            self.image = None
 
+      def render(self, snapshot):
+            key = (snapshot.world_version, tuple(snapshot.located))
+            if self.key != key:
+                  self.image = render_map_inset(snapshot)
+                  self.key = key
+            return self.image
+
+# Define a function to render the map inset (before text is added)
+def render_map_inset(snapshot):
+      worldmap = snapshot.worldmap
       # Create a scaled map for plotting and clean up obs/nav pixels a bit
-      if np.max(Rover.worldmap[:,:,2]) > 0:
-            nav_pix = Rover.worldmap[:,:,2] > 0
-            navigable = Rover.worldmap[:,:,2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
+      if np.max(worldmap[:,:,2]) > 0:
+            nav_pix = worldmap[:,:,2] > 0
+            navigable = worldmap[:,:,2] * (255 / np.mean(worldmap[nav_pix, 2]))
       else:
-            navigable = Rover.worldmap[:,:,2]
-      if np.max(Rover.worldmap[:,:,0]) > 0:
-            obs_pix = Rover.worldmap[:,:,0] > 0
-            obstacle = Rover.worldmap[:,:,0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
+            navigable = worldmap[:,:,2]
+      if np.max(worldmap[:,:,0]) > 0:
+            obs_pix = worldmap[:,:,0] > 0
+            obstacle = worldmap[:,:,0] * (255 / np.mean(worldmap[obs_pix, 0]))
       else:
-            obstacle = Rover.worldmap[:,:,0]
+            obstacle = worldmap[:,:,0].copy()
 
       likely_nav = navigable >= obstacle
       obstacle[likely_nav] = 0
-      plotmap = np.zeros_like(Rover.worldmap)
+      plotmap = np.zeros(worldmap.shape, dtype=np.float)
       plotmap[:, :, 0] = obstacle
       plotmap[:, :, 2] = navigable
       plotmap = plotmap.clip(0, 255)
       # Overlay obstacle and navigable terrain map with ground truth map
-      map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-      # Check whether any rock detections are present in worldmap
-      rock_world_pos = Rover.worldmap[:,:,1].nonzero()
-      # If there are, we'll step through the known sample positions
-      # to confirm whether detections are real
-      samples_located = 0
-      if rock_world_pos[0].any():
-
-            rock_size = 2
-            for idx in range(len(Rover.samples_pos[0])):
-                  test_rock_x = Rover.samples_pos[0][idx]
-                  test_rock_y = Rover.samples_pos[1][idx]
-                  rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1])**2 + \
-                                        (test_rock_y - rock_world_pos[0])**2)
-                  # If rocks were detected within 3 meters of known sample positions
-                  # consider it a success and plot the location of the known
-                  # sample on the map
-                  if np.min(rock_sample_dists) < 3:
-                        samples_located += 1
-                        map_add[test_rock_y-rock_size:test_rock_y+rock_size,
-                        test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
+      map_add = cv2.addWeighted(plotmap, 1, snapshot.ground_truth, 0.5, 0)
+      # Plot the location of the known samples that have been located
+      rock_size = 2
+      for idx in snapshot.located:
+            test_rock_x = snapshot.samples_pos[0][idx]
+            test_rock_y = snapshot.samples_pos[1][idx]
+            map_add[test_rock_y-rock_size:test_rock_y+rock_size,
+            test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
+      # Flip the map for plotting so that the y-axis points upward in the display
+      return np.flipud(map_add).astype(np.float32)
 
-      # Calculate some statistics on the map results
-      # First get the total number of pixels in the navigable terrain map
-      tot_nav_pix = np.float(len((plotmap[:,:,2].nonzero()[0])))
-      # Next figure out how many of those correspond to ground truth pixels
-      good_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] > 0)).nonzero()[0]))
-      # Next find how many do not correspond to ground truth pixels
-      bad_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] == 0)).nonzero()[0]))
-      # Grab the total number of map pixels
-      tot_map_pix = np.float(len((Rover.ground_truth[:,:,1].nonzero()[0])))
-      # Calculate the percentage of ground truth map that has been successfully found
-      perc_mapped = round(100*good_nav_pix/tot_map_pix, 1)
-      if perc_mapped >= 95:
+# Define a function to update the map statistics once per frame. This is
+# kept separate from drawing the insets because it feeds decisions
+# (Rover.head_home) while the insets are purely cosmetic.
+def update_map_statistics(Rover):
+      # Bring the map statistics and the located samples up to date with the
+      # cells changed since the last frame
+      stats = Rover.map_stats
+      stats.update(Rover.world)
+      if Rover.sample_locator is None and Rover.samples_pos is not None:
+            Rover.sample_locator = SampleLocator(Rover.samples_pos, Rover.world.size)
+      if Rover.sample_locator is not None and Rover.sample_locator.update(Rover.world):
+            Rover.located_samples = Rover.sample_locator.located()
+            Rover.samples_located = len(Rover.located_samples)
+      Rover.perc_mapped = stats.perc_mapped()
+      if Rover.perc_mapped >= 95:
           Rover.head_home = True
-      # Calculate the number of good map pixel detections divided by total pixels
-      # found to be navigable terrain
-      if tot_nav_pix > 0:
-            fidelity = round(100*good_nav_pix/(tot_nav_pix), 1)
-      else:
-            fidelity = 0
-      # Flip the map for plotting so that the y-axis points upward in the display
-      map_add = np.flipud(map_add).astype(np.float32)
+      Rover.fidelity = stats.fidelity()
+      return Rover
+
+# Define a function to draw and encode the two inset images of a snapshot
+def render_output_images(snapshot, cache):
+      # Copy the cached map inset so the text below doesn't end up in the cache
+      map_add = cache.render(snapshot).copy()
       # Add some text about map and rock sample detection results
-      cv2.putText(map_add,"Time: "+str(np.round(Rover.total_time, 1))+' s', (0, 10),
+      cv2.putText(map_add,"Time: "+str(np.round(snapshot.total_time, 1))+' s', (0, 10),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"Mapped: "+str(perc_mapped)+'%', (0, 25),
+      cv2.putText(map_add,"Mapped: "+str(snapshot.perc_mapped)+'%', (0, 25),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"Fidelity: "+str(fidelity)+'%', (0, 40),
+      cv2.putText(map_add,"Fidelity: "+str(snapshot.fidelity)+'%', (0, 40),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
       cv2.putText(map_add,"Rocks", (0, 55),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"  Located: "+str(samples_located), (0, 70),
+      cv2.putText(map_add,"  Located: "+str(len(snapshot.located)), (0, 70),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"  Collected: "+str(Rover.samples_collected), (0, 85),
+      cv2.putText(map_add,"  Collected: "+str(snapshot.samples_collected), (0, 85),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
       # Convert map and vision image to base64 strings for sending to server
       pil_img = Image.fromarray(map_add.astype(np.uint8))
@@ -150,23 +192,29 @@ def create_output_images(Rover):
       pil_img.save(buff, format="JPEG")
       encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
 
-      cv2.putText(Rover.vision_image, "Mean Angle: {:.4}".format(Rover.local_mean_ang),
+      vision_image = snapshot.vision_image
+      cv2.putText(vision_image, "Mean Angle: {:.4}".format(snapshot.local_mean_ang),
                   (0, 10), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    #   cv2.putText(Rover.vision_image, "Mean Dist: {:.4}".format(Rover.mean_dist),
+    #   cv2.putText(vision_image, "Mean Dist: {:.4}".format(snapshot.mean_dist),
     #               (0, 25), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(Rover.vision_image, "Steering: {}".format(Rover.steer),
+      cv2.putText(vision_image, "Steering: {}".format(snapshot.steer),
                   (0, 40), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(Rover.vision_image, "Throttle: {}".format(Rover.throttle),
+      cv2.putText(vision_image, "Throttle: {}".format(snapshot.throttle),
                   (0, 55), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(Rover.vision_image, "Brake: {}".format(Rover.brake),
+      cv2.putText(vision_image, "Brake: {}".format(snapshot.brake),
                   (0, 70), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(Rover.vision_image, "Mode: {}".format(Rover.mode),
+      cv2.putText(vision_image, "Mode: {}".format(snapshot.mode),
                   (0, 85), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(Rover.vision_image, "Speed: {}".format(Rover.vel),
+      cv2.putText(vision_image, "Speed: {}".format(snapshot.vel),
                   (0, 100), cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      pil_img = Image.fromarray(Rover.vision_image.astype(np.uint8))
+      pil_img = Image.fromarray(vision_image.astype(np.uint8))
       buff = BytesIO()
       pil_img.save(buff, format="JPEG")
       encoded_string2 = base64.b64encode(buff.getvalue()).decode("utf-8")
 
       return encoded_string1, encoded_string2
+
+# Define a function to create display output given worldmap results
+def create_output_images(Rover):
+      update_map_statistics(Rover)
+      return render_output_images(OutputSnapshot(Rover), Rover.map_inset)
@@ -0,0 +1,76 @@
+import numpy as np
+
+# Numeric telemetry fields sent by the simulator on every frame, with the
+# number of values each one carries (position is "x;y")
+TELEMETRY_FIELDS = [('speed', 1), ('position', 2), ('yaw', 1), ('pitch', 1),
+                    ('roll', 1), ('throttle', 1), ('steering_angle', 1),
+                    ('near_sample', 1), ('picking_up', 1), ('sample_count', 1)]
+
+# Fields that must hold non-negative whole numbers
+INTEGER_FIELDS = ['near_sample', 'picking_up', 'sample_count']
+
+# Decodes the numeric telemetry fields of a frame in one pass: the field
+# strings are joined, the decimal convention is fixed up once for the whole
+# string and every value is parsed with a single split. The simulator uses
+# the decimal separator of its locale, which is detected once per session.
+class TelemetryDecoder():
+    def __init__(self):
+        self.decimal_comma = None # None until the first decimal separator is seen
+        self.names = [name for name, size in TELEMETRY_FIELDS]
+        self.n_values = sum(size for name, size in TELEMETRY_FIELDS)
+        # Position of each field's first value in the parsed list
+        self.offsets = {}
+        offset = 0
+        for name, size in TELEMETRY_FIELDS:
+            self.offsets[name] = offset
+            offset += size
+
+    def _parse(self, text, expected=None):
+        if self.decimal_comma is None:
+            if ',' in text:
+                self.decimal_comma = True
+            elif '.' in text:
+                self.decimal_comma = False
+        if self.decimal_comma:
+            text = text.replace(',', '.')
+        try:
+            values = [float(value) for value in text.split(';')]
+        except ValueError:
+            raise ValueError('Malformed telemetry values: {!r}'.format(text))
+        if expected is not None and len(values) != expected:
+            raise ValueError('Expected {} telemetry values, got {}: {!r}'.format(
+                             expected, len(values), text))
+        return values
+
+    # Parse the numeric fields of a telemetry message into a dict of plain
+    # values: floats, a [x, y] list for position and ints for INTEGER_FIELDS
+    def decode(self, data):
+        try:
+            text = ';'.join([data[name] for name in self.names])
+        except KeyError as err:
+            raise ValueError('Telemetry is missing field {}'.format(err))
+        values = self._parse(text, self.n_values)
+        fields = {}
+        for name, size in TELEMETRY_FIELDS:
+            offset = self.offsets[name]
+            if size == 1:
+                fields[name] = values[offset]
+            else:
+                fields[name] = values[offset:offset + size]
+        for name in INTEGER_FIELDS:
+            value = fields[name]
+            if not (value >= 0 and value == int(value)):
+                raise ValueError('Telemetry field {} must be a non-negative integer, got {}'.format(
+                                 name, value))
+            fields[name] = int(value)
+        return fields
+
+    # Parse the sample positions sent with the first frame (empty strings
+    # mean no samples, e.g. for replayed recordings)
+    def decode_samples(self, data):
+        samples_xpos = np.int_(self._parse(data["samples_x"]) if data["samples_x"] else [])
+        samples_ypos = np.int_(self._parse(data["samples_y"]) if data["samples_y"] else [])
+        if len(samples_xpos) != len(samples_ypos):
+            raise ValueError('Telemetry has {} sample x positions but {} y positions'.format(
+                             len(samples_xpos), len(samples_ypos)))
+        return samples_xpos, samples_ypos
@@ -0,0 +1,172 @@
+# Sweep the terrain classifier thresholds over a recorded run and score every
+# setting against the ground truth map (calibration_images/map_bw.png) with
+# the same mapped/fidelity metrics shown on the map inset.
+# Example: $ python tune_thresholds.py ../test_dataset --red 130:191:10 --green 130:191:10
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+import cv2
+
+from perception import (get_warp_engine, get_pixel_tables, labels_to_world_batch,
+                        level_for_mapping)
+from world_map import WorldMap, MapStatistics, ROCK, NAVIGABLE
+from rover_state import ground_truth_3d
+from dataset import open_run
+
+# Frames warped and projected together while building a ThresholdCache
+chunk_size = 32
+
+# Everything about a run that does not depend on the thresholds: the RGB and
+# HSV value and world map cell of every pixel of the warped view, for every
+# frame that would be mapped (rover level). Evaluating a setting then only
+# reruns the thresholds and one np.bincount, instead of decoding, warping and
+# projecting every frame again.
+class ThresholdCache():
+    def __init__(self, rgb, hsv, x_world, y_world, frame, world_size=200):
+        self.rgb = rgb # (P, 3) uint8 warped pixel colors
+        self.hsv = hsv # (P, 3) uint8 the same pixels in OpenCV HSV
+        self.x_world = x_world # (P,) world map cell of each pixel
+        self.y_world = y_world
+        self.frame = frame # (P,) index of the frame each pixel came from
+        self.world_size = world_size
+        self.stats = MapStatistics(ground_truth_3d)
+        # Cells as index arrays, converted once rather than on every score()
+        self._cells = (x_world.astype(np.intp), y_world.astype(np.intp))
+
+    # Define a function to build the cache for a run, warping and projecting
+    # chunk_size frames at a time
+    @classmethod
+    def build(cls, run, start=0, limit=None, world_size=200):
+        stop = len(run) if limit is None else min(start + limit, len(run))
+        telemetry = run.telemetry[start:stop]
+        level = start + np.flatnonzero(level_for_mapping(telemetry['roll'], telemetry['pitch']))
+        parts = []
+        for chunk in range(0, len(level), chunk_size):
+            idx = level[chunk:chunk + chunk_size]
+            frames = np.stack([run.frame(i) for i in idx])
+            warped = get_warp_engine(frames.shape[1:]).warp_batch(frames)
+            # Every pixel of the warped view, i.e. not black
+            seen = warped.any(axis=-1).astype(np.uint8)
+            rows = run.telemetry[idx]
+            ((frame, x_world, y_world),) = labels_to_world_batch(
+                seen, get_pixel_tables(seen.shape[1:]), rows['x'], rows['y'], rows['yaw'],
+                world_size, 10, flags=(1,))
+            hsv = cv2.cvtColor(warped.reshape(-1, warped.shape[2], 3), cv2.COLOR_RGB2HSV)
+            mask = seen.reshape(-1).view(bool)
+            parts.append((warped.reshape(-1, 3)[mask], hsv.reshape(-1, 3)[mask],
+                          x_world, y_world, idx[frame]))
+        if not parts:
+            raise ValueError('No level frames to tune on')
+        cell_dtype = np.min_scalar_type(world_size - 1)
+        rgb, hsv, x_world, y_world, frame = [np.concatenate(column) for column in zip(*parts)]
+        return cls(rgb, hsv, x_world.astype(cell_dtype), y_world.astype(cell_dtype),
+                   frame.astype(np.int32), world_size)
+
+    def save(self, path):
+        np.savez(path, rgb=self.rgb, hsv=self.hsv, x_world=self.x_world,
+                 y_world=self.y_world, frame=self.frame, world_size=self.world_size)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['rgb'], data['hsv'], data['x_world'], data['y_world'],
+                   data['frame'], int(data['world_size']))
+
+    # Score one setting: map the navigable pixels (same test as color_thresh)
+    # and the rock pixels (same HSV range test as rock_thresh)
+    def score(self, rgb_thresh, rock_lower, rock_upper):
+        nav = ((self.rgb[:, 0] > rgb_thresh[0]) & (self.rgb[:, 1] > rgb_thresh[1])
+               & (self.rgb[:, 2] > rgb_thresh[2]))
+        rock = np.all((self.hsv >= np.array(rock_lower, dtype=np.uint8))
+                      & (self.hsv <= np.array(rock_upper, dtype=np.uint8)), axis=1)
+        x_world, y_world = self._cells
+        world = WorldMap(self.world_size, dtype=np.uint32)
+        world.update(((x_world[nav], y_world[nav], NAVIGABLE),
+                      (x_world[rock], y_world[rock], ROCK)))
+        self.stats.recount(world)
+        return {'rgb_thresh': [int(value) for value in rgb_thresh],
+                'rock_lower': [int(value) for value in rock_lower],
+                'rock_upper': [int(value) for value in rock_upper],
+                'mapped': self.stats.perc_mapped(),
+                'fidelity': self.stats.fidelity(),
+                'rock_cells': int(np.count_nonzero(world.counts[:,:,ROCK])),
+                'rock_frames': int(len(np.unique(self.frame[rock])))}
+
+# Define a function to parse a sweep argument: "160", "140,160,180" or the
+# range "start:stop:step"
+def parse_values(text):
+    if ':' in text:
+        return list(range(*[int(value) for value in text.split(':')]))
+    return [int(value) for value in text.split(',')]
+
+# Define a function to evaluate every combination of the swept values
+def sweep(cache, red, green, blue, hue_low, hue_high, sat_low, val_low):
+    results = []
+    for r, g, b, h_low, h_high, s_low, v_low in itertools.product(
+            red, green, blue, hue_low, hue_high, sat_low, val_low):
+        results.append(cache.score((r, g, b), (h_low, s_low, v_low), (h_high, 255, 255)))
+    return results
+
+# Define a function to rank results: highest mapped percentage among the
+# settings that reach min_fidelity, then by fidelity
+def rank(results, min_fidelity):
+    return sorted(results, key=lambda result: (result['fidelity'] >= min_fidelity,
+                                               result['mapped'], result['fidelity']),
+                  reverse=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune terrain thresholds on a recorded run')
+    parser.add_argument(
+        'run',
+        type=str,
+        nargs='?',
+        default='../test_dataset',
+        help='Recorded run: a folder containing robot_log.csv (or the csv itself), or a packed run folder.'
+    )
+    parser.add_argument('--start', type=int, default=0, help='Index of the first frame to use.')
+    parser.add_argument('--limit', type=int, default=None, help='Use at most this many frames.')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='.npz file holding the warped pixels of the run; built and saved if missing.')
+    parser.add_argument('--red', type=parse_values, default=[160], help='Red thresholds to sweep.')
+    parser.add_argument('--green', type=parse_values, default=[160], help='Green thresholds to sweep.')
+    parser.add_argument('--blue', type=parse_values, default=[160], help='Blue thresholds to sweep.')
+    parser.add_argument('--hue-low', type=parse_values, default=[22], help='Lowest rock hue values to sweep.')
+    parser.add_argument('--hue-high', type=parse_values, default=[28], help='Highest rock hue values to sweep.')
+    parser.add_argument('--sat-low', type=parse_values, default=[150], help='Lowest rock saturation values to sweep.')
+    parser.add_argument('--val-low', type=parse_values, default=[150], help='Lowest rock values to sweep.')
+    parser.add_argument('--min-fidelity', type=float, default=95.0,
+                        help='Prefer settings with at least this fidelity (%%).')
+    parser.add_argument('--top', type=int, default=10, help='Print this many of the best settings.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write every result and the best setting to this JSON file (usable with drive_rover.py --thresholds).')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        cache = ThresholdCache.load(args.cache) if args.cache else None
+    except IOError:
+        cache = None
+    if cache is None:
+        cache = ThresholdCache.build(open_run(args.run), args.start, args.limit)
+        if args.cache:
+            cache.save(args.cache)
+    t1 = time.perf_counter()
+    results = rank(sweep(cache, args.red, args.green, args.blue, args.hue_low,
+                         args.hue_high, args.sat_low, args.val_low), args.min_fidelity)
+    t2 = time.perf_counter()
+    print('Cached {} pixels of {} frames in {:.2f} s, evaluated {} settings in {:.2f} s'.format(
+          len(cache.rgb), len(np.unique(cache.frame)), t1 - t0, len(results), t2 - t1))
+    print('{:>15} {:>15} {:>15} {:>8} {:>9} {:>6} {:>7}'.format(
+          'rgb_thresh', 'rock_lower', 'rock_upper', 'mapped', 'fidelity', 'rocks', 'frames'))
+    for result in results[:args.top]:
+        print('{:>15} {:>15} {:>15} {:>7}% {:>8}% {:>6} {:>7}'.format(
+              *[str(tuple(result[key])) for key in ('rgb_thresh', 'rock_lower', 'rock_upper')],
+              result['mapped'], result['fidelity'], result['rock_cells'], result['rock_frames']))
+    if args.output:
+        best = results[0]
+        with open(args.output, 'w') as output_file:
+            json.dump({'best': {'rgb_thresh': best['rgb_thresh'], 'rock_lower': best['rock_lower'],
+                                'rock_upper': best['rock_upper']},
+                       'results': results}, output_file, indent=2)
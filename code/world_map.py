@@ -0,0 +1,221 @@
+import numpy as np
+
+# Channels of the world map, same layout as Rover.worldmap
+OBSTACLE = 0
+ROCK = 1
+NAVIGABLE = 2
+
+# Accumulates terrain detections into a size x size x 3 world map.
+# Counters are compact unsigned integers that saturate instead of wrapping,
+# and all detections of a frame are counted in one batch so a cell seen by
+# several pixels in the same frame is counted every time. Only the range of
+# entries the frame touches is counted, so an update costs O(pixels), not
+# O(map size).
+# Optional modes:
+#   decay_interval: every decay_interval updates, counts lose 1/2**decay_shift
+#                   of their value (rounded up, so every count eventually
+#                   reaches 0) and stale detections fade out
+#   log_odds:       also keep an int16 occupancy log-odds grid where obstacle
+#                   hits add log_odds_hit and navigable hits subtract
+#                   log_odds_miss, clamped to +/- log_odds_limit
+class WorldMap():
+    def __init__(self, size=200, dtype=np.uint16, decay_interval=None, decay_shift=4,
+                 log_odds=False, log_odds_hit=3, log_odds_miss=1, log_odds_limit=1000):
+        self.size = size
+        self.counts = np.zeros((size, size, 3), dtype=dtype)
+        self.cap = np.iinfo(dtype).max
+        self.decay_interval = decay_interval
+        self.decay_shift = decay_shift
+        self.log_odds_hit = log_odds_hit
+        self.log_odds_miss = log_odds_miss
+        self.log_odds_limit = log_odds_limit
+        if log_odds:
+            self.log_odds = np.zeros((size, size), dtype=np.int16)
+        else:
+            self.log_odds = None
+        self.updates = 0 # Number of update() calls so far
+        self.version = 0 # Incremented every time the map changes
+        # Flat indices into counts of the entries changed by the last update,
+        # or None if the whole map may have changed (after a decay)
+        self.changed = np.zeros(0, dtype=np.intp)
+
+    # Add one frame of detections. points is a sequence of
+    # (x_world, y_world, channel) tuples, one per pixel class.
+    def update(self, points):
+        flat_index = np.concatenate([(y * self.size + x) * 3 + channel
+                                     for x, y, channel in points])
+        changed, hits = self._count_hits(flat_index)
+        flat_counts = self.counts.reshape(-1)
+        # Saturating add, only touching cells hit in this frame
+        new_counts = flat_counts[changed] + hits
+        np.minimum(new_counts, self.cap, out=new_counts)
+        flat_counts[changed] = new_counts
+        self.changed = changed
+        modified = len(changed) > 0
+        if self.log_odds is not None and modified:
+            self._update_log_odds(changed, hits)
+        self.updates += 1
+        if self.decay_interval and self.updates % self.decay_interval == 0:
+            modified |= self.decay()
+        if modified:
+            self.version += 1
+        return self.changed
+
+    # Sorted flat indices hit by a frame and the number of hits of each.
+    # A bincount over the range of indices the frame spans (bounded by the
+    # camera's reach) is much faster than sorting; frames whose indices are
+    # spread thinly over a wide range are counted with np.unique instead.
+    def _count_hits(self, flat_index):
+        if len(flat_index) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        low = flat_index.min()
+        span = flat_index.max() - low + 1
+        if span > 8 * len(flat_index):
+            return np.unique(flat_index, return_counts=True)
+        hits = np.bincount(flat_index - low, minlength=span)
+        changed = np.flatnonzero(hits)
+        return changed + low, hits[changed]
+
+    # Take 1/2**decay_shift (rounded up) off every count, returns True if any
+    # count changed
+    def decay(self):
+        decrement = self.counts >> self.decay_shift
+        decrement += (self.counts & ((1 << self.decay_shift) - 1)) > 0
+        if not decrement.any():
+            return False
+        self.counts -= decrement
+        self.changed = None
+        return True
+
+    def _update_log_odds(self, changed, hits):
+        channel = changed % 3
+        evidence = np.where(channel == OBSTACLE, hits * self.log_odds_hit, 0)
+        evidence -= np.where(channel == NAVIGABLE, hits * self.log_odds_miss, 0)
+        # changed is sorted, so the entries of a cell are next to each other
+        cells, first = np.unique(changed // 3, return_index=True)
+        evidence = np.add.reduceat(evidence, first)
+        cells = cells[evidence != 0]
+        evidence = evidence[evidence != 0]
+        flat_log_odds = self.log_odds.reshape(-1)
+        new_log_odds = flat_log_odds[cells] + evidence
+        np.clip(new_log_odds, -self.log_odds_limit, self.log_odds_limit, out=new_log_odds)
+        flat_log_odds[cells] = new_log_odds
+
+    # Occupancy probability of each cell (log_odds mode only), where one
+    # log-odds unit is 0.1 in natural log space
+    def occupancy(self):
+        return 1 / (1 + np.exp(-0.1 * self.log_odds.astype(np.float32)))
+
+    def clear(self):
+        self.counts[:] = 0
+        if self.log_odds is not None:
+            self.log_odds[:] = 0
+        self.updates = 0
+        self.changed = None
+        self.version += 1
+
+# Map statistics reported on the map inset, tracked incrementally from the
+# entries a WorldMap changed so each update is O(cells changed) rather than
+# O(map size). The ground truth mask and its pixel count are computed once.
+class MapStatistics():
+    def __init__(self, ground_truth):
+        # Ground truth navigable terrain (green channel of the 3d ground truth)
+        self.truth = ground_truth[:,:,1] > 0
+        self.tot_map_pix = np.count_nonzero(self.truth)
+        # Cells with any navigable detection, and how many of them are real
+        self.nav_seen = np.zeros(self.truth.shape, dtype=bool)
+        self.tot_nav_pix = 0
+        self.good_nav_pix = 0
+        self.version = None # WorldMap.version the statistics reflect
+
+    # Bring the statistics up to date with world, returns True if they changed
+    def update(self, world):
+        if world.version == self.version:
+            return False
+        changed = world.changed
+        if self.version is None or changed is None or world.version != self.version + 1:
+            # Missed an update, or the whole map changed (decay or clear)
+            self.recount(world)
+        else:
+            channel = changed % 3
+            nav_entries = changed[channel == NAVIGABLE]
+            nav_cells = nav_entries // 3
+            now_seen = world.counts.reshape(-1)[nav_entries] > 0
+            was_seen = self.nav_seen.reshape(-1)[nav_cells]
+            gained = nav_cells[now_seen & ~was_seen]
+            lost = nav_cells[~now_seen & was_seen]
+            self.nav_seen.reshape(-1)[gained] = True
+            self.nav_seen.reshape(-1)[lost] = False
+            truth = self.truth.reshape(-1)
+            self.tot_nav_pix += len(gained) - len(lost)
+            self.good_nav_pix += (np.count_nonzero(truth[gained])
+                                  - np.count_nonzero(truth[lost]))
+        self.version = world.version
+        return True
+
+    def recount(self, world):
+        self.nav_seen = world.counts[:,:,NAVIGABLE] > 0
+        self.tot_nav_pix = np.count_nonzero(self.nav_seen)
+        self.good_nav_pix = np.count_nonzero(self.nav_seen & self.truth)
+        self.version = world.version
+
+    # Percentage of the ground truth map that has been successfully found
+    def perc_mapped(self):
+        return round(100*self.good_nav_pix/self.tot_map_pix, 1)
+
+    # Good map pixel detections divided by all pixels found to be navigable
+    def fidelity(self):
+        if self.tot_nav_pix > 0:
+            return round(100*self.good_nav_pix/self.tot_nav_pix, 1)
+        return 0
+
+# Confirms known rock sample positions against the rock detections of a
+# WorldMap: a sample is located once any rock cell lies within radius of it.
+# Every cell near a sample is looked up once in a per-cell table of sample
+# bit masks, so an update only looks up the rock entries the WorldMap
+# changed (O(1) each) instead of measuring the distance from every sample
+# to every rock cell. Supports up to 64 samples.
+class SampleLocator():
+    def __init__(self, samples_pos, size=200, radius=3):
+        samples_x, samples_y = samples_pos
+        if len(samples_x) > 64:
+            raise ValueError('SampleLocator supports up to 64 samples, got {}'.format(len(samples_x)))
+        self.size = size
+        self.samples = (np.asarray(samples_x), np.asarray(samples_y))
+        # Bit mask of the samples within radius of each cell
+        self.cell_samples = np.zeros(size * size, dtype=np.uint64)
+        reach = int(np.ceil(radius))
+        d_y, d_x = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+        for idx, (sample_x, sample_y) in enumerate(zip(samples_x, samples_y)):
+            cell_x = sample_x + d_x
+            cell_y = sample_y + d_y
+            near = (np.sqrt((sample_x - cell_x)**2 + (sample_y - cell_y)**2) < radius) \
+                   & (cell_x >= 0) & (cell_x < size) & (cell_y >= 0) & (cell_y < size)
+            self.cell_samples[cell_y[near] * size + cell_x[near]] |= np.uint64(1 << idx)
+        self.mask = 0 # Bit mask of the located samples
+        self.version = None # WorldMap.version the located samples reflect
+
+    # Bring the located samples up to date with world, returns True if they
+    # changed
+    def update(self, world):
+        if world.version == self.version:
+            return False
+        previous = self.mask
+        changed = world.changed
+        flat_counts = world.counts.reshape(-1)
+        if self.version is None or changed is None or world.version != self.version + 1:
+            # Missed an update, or the whole map changed (decay or clear)
+            rock_cells = np.flatnonzero(world.counts[:,:,ROCK])
+            self.mask = 0
+        else:
+            # Counts only grow between decays, so only new rock cells matter
+            rock_entries = changed[changed % 3 == ROCK]
+            rock_cells = rock_entries[flat_counts[rock_entries] > 0] // 3
+        if len(rock_cells) > 0:
+            self.mask |= int(np.bitwise_or.reduce(self.cell_samples[rock_cells]))
+        self.version = world.version
+        return self.mask != previous
+
+    # Indices of the located samples, in ascending order
+    def located(self):
+        return [idx for idx in range(len(self.samples[0])) if self.mask >> idx & 1]